@@ -16,7 +16,16 @@
 # Import names for simplify user imports
 
 from base import *
+
+__version__ = VERSION
+
 from report import Report
 from pdfrenderer import PDFRenderer
+from directpdfrenderer import DirectPDFRenderer
+from tabularrenderer import TabularRenderer
+from svgrenderer import SVGRenderer
+from nullrenderer import NullRenderer
+from teerenderer import TeeRenderer
 import dataproviders
-from parser import XMLParser
\ No newline at end of file
+from parser import XMLParser
+from prepared import PreparedReport
\ No newline at end of file
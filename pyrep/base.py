@@ -12,14 +12,22 @@ Millimeters is the default unit of measurement.
 import copy
 import datetime
 import decimal
+import os
 import random
+import tempfile
 import time
 import locale
 
+from cStringIO import StringIO
+
 import dataproviders
+import textlayout
 
 from fonts import Font
 
+# PyRep's version
+VERSION = "0.1"
+
 def mm(*values):
     """
     Returns the given values in millimeters (does nothing, since mm is the default)
@@ -51,6 +59,41 @@ class ReportError(StandardError):
     Exception
     """
 
+# Compiled expressions, by source: (code, constant) tuples
+_compiled = dict()
+
+# Values of the constant expressions, by source
+_constants = dict()
+
+def compile_expression(expr):
+    """
+    Compiles a report expression. Compiled expressions are cached, so each expression is compiled only once per process.
+    @param expr: The expression's source
+    @returns: A (code, constant) tuple. constant is True if the expression doesn't use any name, 
+              so its value never changes
+    @raise ReportError: if the expression isn't valid
+    """
+    
+    try:
+        return _compiled[expr]
+    except KeyError:
+        pass
+    
+    if "__import__" in expr:
+        raise ReportError("You cannot use __import__!")
+    
+    try:
+        code = compile(expr.strip(), "<expression>", "eval")
+    except StandardError, e:
+        raise ReportError(str(e))
+    
+    # Nested code objects (eg. generator expressions) may use names on their own
+    constant = not code.co_names and not [c for c in code.co_consts if hasattr(c, "co_names")]
+    
+    ret = _compiled[expr] = (code, constant)
+    
+    return ret
+
 class Size(object):
     """
     Encapsulate a size as a width, height tuple.
@@ -160,14 +203,7 @@ class Color(object):
         Converts the color values to hex (web) format
         """
         
-        ret = ["#"]
-        
-        for x in (self.red, self.green, self.blue):
-            c = "%X"%x
-            if len(c) == 1: c = "0%s"%c
-            ret.append(c)
-            
-        return "".join(ret)
+        return "#%02X%02X%02X"%(self.red, self.green, self.blue)
     
     @classmethod
     def from_hex(cls, hexvalue):
@@ -331,6 +367,7 @@ class Container(DrawableObject):
     """
     An object that contains one or more children
     @ivar children: A list of the object's children 
+    @ivar stretchable: The children that can grow to fit their content
     @ivar default_font: The default font for this container (used if children don't have an explicit font)
     @type default_font: Font object
     """
@@ -345,6 +382,7 @@ class Container(DrawableObject):
         super(Container, self).__init__(size, **kwargs)
         
         self.children = list()
+        self.stretchable = list()
         
         self.default_font = kwargs.get("default_font", Font("default", "Helvetica", 10))
         
@@ -370,6 +408,9 @@ class Container(DrawableObject):
         
         child.position = position
         self.children.append(child)
+        
+        if getattr(child, "stretch", False):
+            self.stretchable.append(child)
     
     def get_font(self, name):
         return self.parent.get_font(name)
@@ -447,9 +488,32 @@ class Page(DrawableObject):
         
 class Picture(DrawableObject):
     """
-    An image - TO DEFINE
+    An image, scaled to the object's size
+    @ivar value: The image source. Could be any valid python expression that will be evaluated on runtime,
+                 giving a file name, the image's binary data (eg. a database blob) or a file-like object
+    @type value: string
     """
     
+    def __init__(self, size, **kwargs):
+        """
+        Constructor
+        @param size: The picture's size as a tuple of (width, height)
+        @keyword value: The image source (a valid python expression to be evaluated)
+        """
+        
+        super(Picture, self).__init__(size, **kwargs)
+        
+        self.value = kwargs.get('value', "")
+    
+    def draw(self, renderer, environment = None):
+        """
+        Draws the component using the given renderer
+        """
+        renderer.draw_picture(self, environment)
+    
+    def __str__(self):
+        return "Picture object: %s"%self.value
+    
 class Text(DrawableObject):
     """
     A Text value, used to display any kind of textual value
@@ -474,28 +538,48 @@ class Text(DrawableObject):
         @keyword value: Object's value (a valid python expression to be evaulated)
         @keyword alignment: one of ALIGN_LEFT, ALIGN_CENTER, ALIGN_RIGHT: Aligns the text in the field
         @keyword color: Text color
-        @keyword stretch: TO DOCUMENT
+        @keyword stretch: If True, the value is wrapped into the field's width and the field grows 
+                          (along with its section) to fit all the lines
+        @keyword ellipsis: If True, a value too long for the field is cut and ends with an ellipsis
         """
         
         super(Text,self).__init__(size, **kwargs)
         
-        self.font = kwargs.get('font', None)
-        if isinstance(self.font, basestring):
-            self.font = self.parent.get_font(self.font)
+        self._font = kwargs.get('font', None)
+        if isinstance(self._font, basestring) and self.parent is not None:
+            self._font = self.parent.get_font(self._font)
         
         self.value = kwargs.get('value', "")
         
         self.alignment = kwargs.get('alignment', self.__class__.ALIGN_LEFT)
         
         self.color = kwargs.get('color', None)
+        
+        self.stretch = kwargs.get('stretch', False)
+        
+        self.ellipsis = kwargs.get('ellipsis', False)
+    
+    def _get_font(self):
+        """
+        Returns the object's font. If not set, the parent's default font is used. A font given 
+        by name is looked up in the parent (so it can be set before adding the object to its parent)
+        """
+        font = self._font
+        if font is None:
+            return self.parent.default_font
+        if isinstance(font, basestring):
+            return self.parent.get_font(font)
+        return font
+    
+    def _set_font(self, font):
+        self._font = font
+    
+    font = property(_get_font, _set_font, None, """ Object's font """)
     
     def draw(self, renderer, environment = None):
         """
         Draws the component using the given renderer
         """
-        if self.font is None:
-            self.font = self.parent.default_font
-            
         renderer.draw_text(self, environment)
     
     def __str__(self):
@@ -589,6 +673,22 @@ class Section(Container):
         
     size = property(get_size, set_size, None, """ Section's size """)
     
+    def get_stretched_height(self, renderer, environment = None):
+        """
+        Returns the section's height after its stretchable children have grown to fit their values
+        @param renderer: The renderer that will draw the section
+        @param environment: The environment data to use
+        """
+        
+        height = self.height
+        
+        for child in self.stretchable:
+            h = child.y + renderer.get_text_height(child, environment)
+            if h > height:
+                height = h
+        
+        return height
+    
     def __getattr__(self, attr):
         """
         We return section's name as the real name. This is a little bit tricky...
@@ -617,16 +717,94 @@ class Group(object):
         self.header = Section(self, (0,0))
         self.footer = Section(self, (0,0))
 
+class RenderContext(object):
+    """
+    The state of a single run of a report. The Report object and its children are never changed 
+    while processing, all the run-time values live here: so the same report can be processed 
+    by several renderers (and threads) at once.
+    @ivar report: The Report being processed
+    @ivar pagenum: The current page number
+    @ivar currentrow: The current datasource's row
+    @ivar variables: The current values of the report's variables, by name
+    @ivar parameters: The values of the report's parameters, by name
+    @ivar calcs: The state of the report's calculations, as [partial, count] lists
+    @ivar positions: The current vertical position of the report's sections
+    @ivar page_records: For each page, the (first, last) datasource record numbers (starting from 1) 
+                        printed on it, or None if the page doesn't print any record
+    """
+    
+    def __init__(self, report, parameters = None):
+        """
+        Constructor
+        @param report: The Report object to process
+        @param parameters: A mapping of parameter names to values, overriding the parameters' default values
+        @raise ReportError: if a parameter isn't defined by the report
+        """
+        
+        self.report = report
+        
+        self.pagenum = 0
+        self.currentrow = None
+        
+        self.variables = dict((name, var.value) for name, var in report.variables.items())
+        
+        self.parameters = dict((name, par.value) for name, par in report.parameters.items())
+        if parameters:
+            for name, value in parameters.items():
+                try:
+                    par = report.parameters[name]
+                except KeyError:
+                    raise ReportError("Unknown parameter: %s"%name)
+                
+                self.parameters[name] = par.vartypes[par.type](value)
+        
+        self.calcs = dict((calc, [calc.partial, calc.count]) for calc in report.calculations)
+        
+        self.positions = dict()
+        
+        self.page_records = list()
+    
+    def get_y(self, section):
+        """
+        Returns the current vertical position of a section
+        """
+        return self.positions.get(section, section.y)
+    
+    def set_y(self, section, y):
+        """
+        Sets the current vertical position of a section
+        """
+        self.positions[section] = y
+    
+    def save_calcs(self):
+        """
+        Returns a copy of the variables and of the calculations' state, for restore_calcs
+        """
+        return (dict(self.variables), dict((calc, list(state)) for calc, state in self.calcs.items()))
+    
+    def restore_calcs(self, saved):
+        """
+        Restores the variables and the calculations' state returned by save_calcs
+        """
+        self.variables, self.calcs = saved
+
 class Data(object):
     """
-    TODO: TO DOCUMENT
+    The environment expressions are evaluated in: gives them access to the current row, 
+    variables, parameters, system values and "safe" functions.
+    @ivar report: The Report object
+    @ivar context: The RenderContext of the current run
     """
     class _Object(object):
         pass
     
-    def __init__(self, report):
+    def __init__(self, report, context = None):
         self.report = report
         
+        if context is None:
+            context = RenderContext(report)
+        self.context = context
+        
     def get_data(self):
         """
         Returns valid data
@@ -645,18 +823,16 @@ class Data(object):
 
         # System variables
         system = self.__class__._Object()
-        system.page = self.report.pagenum     # Current page number
+        system.page = self.context.pagenum     # Current page number
         system.date = datetime.date.today()
 
         # User-defined variables
         vars = self.__class__._Object()
-        for name, val in self.report.variables.items():
-            setattr(vars, name, val.value)
+        vars.__dict__.update(self.context.variables)
 
         # Report parameters
         parameters = self.__class__._Object()
-        for name, val in self.report.parameters.items():
-            setattr(parameters, name, val.value)
+        parameters.__dict__.update(self.context.parameters)
             
         # System functions
         funcs = self.__class__._Object()
@@ -675,19 +851,56 @@ class Data(object):
             setattr(funcs, name, locals()[name])
         
         # Current datasource row
-        row = self.report.currentrow
+        row = self.context.currentrow
                 
         d = dict()
-        for n in ('system', 'vars', 'row', 'funcs'):
+        for n in ('system', 'vars', 'parameters', 'row', 'funcs'):
             d[n] = locals()[n]
             
         return d
                     
+class Evaluated(object):
+    """
+    An environment holding an already evaluated value: the renderers' safe_eval returns it 
+    as the value of any expression. Look at TeeRenderer
+    @ivar value: The evaluated value
+    """
+    
+    __slots__ = ("value", )
+    
+    def __init__(self, value):
+        self.value = value
+                    
+class ChunkBuffer(object):
+    """
+    A file-like object collecting the written data until it's taken
+    """
+    
+    def __init__(self):
+        self._chunks = list()
+    
+    def write(self, data):
+        self._chunks.append(data)
+    
+    def flush(self):
+        pass
+    
+    def take(self):
+        """
+        Returns the data written since the last call
+        """
+        data = "".join(self._chunks)
+        self._chunks = list()
+        return data
+
 class Renderer(object):
     """
     Base renderer class
     """
     
+    # The output files' suffix
+    suffix = ""
+    
     def __init__(self, report):
         """
         Constructor
@@ -695,20 +908,38 @@ class Renderer(object):
         """
         
         self.report = report
+        
+        # Last wrapped value of each stretchable text
+        self._wrapped = dict()
 
     def render(self, *args, **kwargs):
+        """
+        Prepares the data sources. Subclasses should call it before processing the report
+        @keyword datasources: A list of DataProvider objects, used instead of the report's datasources
+        @keyword maindatasource: The main datasource (defaults to the first one)
+        @keyword parameters: A mapping of the report's parameter values
+        @keyword pages: A (first, last) tuple: only the pages in this range (starting from 1) are drawn
+        @keyword conn: dbapi2 connection used by the datasources
+        @keyword module: dbapi2 module used by the datasources
+        @keyword conn_pars: dbapi2 connection parameters used by the datasources
+        """
+        
+        self.parameters = kwargs.get('parameters', None)
+        
+        self.pages = kwargs.get('pages', None)
 
         # Data sources
         self.datasources = kwargs.get('datasources', None)
         if self.datasources is None:
             if self.report.datasources:
+                # Running a datasource changes it: run a copy, so the report is left untouched
                 self.datasources = []
                 if "main" in self.report.datasources:
-                    self.datasources.append(self.report.datasources['main'])
+                    self.datasources.append(copy.copy(self.report.datasources['main']))
                     
                 for name, ds in self.report.datasources.items():
                     if name != 'main':
-                        self.datasources.append(ds)
+                        self.datasources.append(copy.copy(ds))
 
             
         if not self.datasources:
@@ -723,7 +954,122 @@ class Renderer(object):
                 if arg in ("conn", "module", "conn_pars"):
                     dargs[arg] = kwargs[arg]
             ds.run(**dargs)
+    
+    def open_output(self, suffix, **kwargs):
+        """
+        Opens the output file, as requested by the render method's keywords:
+        @keyword outfile: The output file name, or a file object opened for binary writing. If not given, 
+                          a temporary file will be created
+        @keyword output: "bytes" or "memoryview": the output is kept in memory, and returned by render 
+                         as a string or a memoryview (outfile is ignored). 
+                         "chunks": render returns an iterator of data chunks. Look at render_chunks
+        @param suffix: The temporary file's suffix
+        @returns: A tuple of (file object, path). The path is None if the output isn't a named file
+        @raise ReportError: on an invalid output keyword
+        """
+        
+        output = kwargs.get("output", None)
+        if output == "chunks":
+            return ChunkBuffer(), None
+        
+        if output is not None:
+            if output not in ("bytes", "memoryview"):
+                raise ReportError("Invalid output: %s"%output)
+            return StringIO(), None
+        
+        outfile = kwargs.get("outfile", None)
+        if outfile is None:
+            fd, outfile = tempfile.mkstemp(suffix, "REP_")
+            return os.fdopen(fd, "wb"), outfile
+        
+        if hasattr(outfile, "write"):
+            return outfile, None
+        
+        return open(outfile, "wb"), outfile
+    
+    def close_output(self, out, path, **kwargs):
+        """
+        Closes (or flushes) the output opened by open_output
+        @param out: The output file object
+        @param path: The output file path, as returned by open_output
+        @returns: What the render method should return: the output file's path, the given file object, 
+                  or the output data (look at open_output)
+        """
+        
+        output = kwargs.get("output", None)
+        if output is not None:
+            data = out.getvalue()
+            if output == "memoryview":
+                return memoryview(data)
+            return data
         
+        if path is None:
+            out.flush()
+            return kwargs["outfile"]
+        
+        out.close()
+        return path
+    
+    def render_chunks(self, out, options):
+        """
+        Renders the report to a ChunkBuffer, yielding the data written as soon as each page is 
+        finished, and the end of the document at last. So the first pages can be sent (eg. to an 
+        HTTP client) while the next ones are still being laid out.
+        @param out: A ChunkBuffer, as returned by open_output
+        @param options: The render method's keyword arguments
+        """
+        
+        self._begin_document(out, options)
+        
+        try:
+            for pagenum in self.report.iter_process(self):
+                data = out.take()
+                if data:
+                    yield data
+        except:
+            # Also when the consumer stops iterating
+            self._abort_document()
+            raise
+        
+        self._end_document()
+        
+        data = out.take()
+        if data:
+            yield data
+    
+    def _begin_document(self, out, options):
+        """
+        Starts the output document. Called before processing the report
+        @param out: The output file object
+        @param options: The render method's keyword arguments
+        """
+        raise NotImplementedError("Please use a subclass!")
+    
+    def _end_document(self):
+        """
+        Completes the output document. Called after processing the report
+        """
+        raise NotImplementedError("Please use a subclass!")
+    
+    def _abort_document(self):
+        """
+        Releases the output document's resources (eg. worker threads). Called instead of 
+        _end_document when processing the report fails
+        """
+        pass
+        
+    def paginate(self, **kwargs):
+        """
+        Computes the report's pagination, without drawing anything. 
+        Takes the same datasource keywords as render
+        @returns: For each page, the (first, last) datasource record numbers printed on it, 
+                  or None if the page doesn't print any record (eg. a page with the summary only)
+        """
+        
+        Renderer.render(self, **kwargs)
+        
+        return self.report.process(self, dry_run = True).page_records
+    
     def start_page(self):
         pass
     
@@ -742,6 +1088,55 @@ class Renderer(object):
     def draw_box(self, shape, environment = None):
         raise NotImplementedError("Please use a subclass!")
     
+    def draw_picture(self, picture, environment = None):
+        raise NotImplementedError("Please use a subclass!")
+    
+    def get_glyph_widths(self, font):
+        """
+        Returns the glyph width table used to measure text in the given font. 
+        This implementation doesn't know any real metrics and uses an average width for each glyph, 
+        subclasses should override it.
+        @param font: A Font object
+        @returns: A textlayout.GlyphWidths object
+        """
+        return textlayout.get_glyph_widths(None)
+    
+    def wrap_text(self, text, environment = None):
+        """
+        Evaluates the value of a stretchable text and breaks it into lines fitting the text's width
+        @param text: The Text object
+        @param environment: The environment data to use
+        @returns: A list of lines
+        """
+        
+        txt = str(self.safe_eval(text.value, environment))
+        
+        # The same text is usually measured and then drawn: don't break it twice
+        last = self._wrapped.get(text)
+        if last is not None and last[0] == txt:
+            return last[1]
+        
+        font = text.font
+        
+        lines = textlayout.wrap_text(txt, self.get_glyph_widths(font), font.size, text.width * textlayout.PT_PER_MM)
+        self._wrapped[text] = (txt, lines)
+        
+        return lines
+    
+    def get_text_height(self, text, environment = None):
+        """
+        Returns the height of a text object, once stretched to fit its value
+        @param text: The Text object
+        @param environment: The environment data to use
+        """
+        
+        if not text.stretch:
+            return text.height
+        
+        h = len(self.wrap_text(text, environment)) * textlayout.line_height(text.font.size)
+        
+        return max(h, text.height)
+    
     def safe_eval(self, expr, environment):
         """
         Safely evaluates the expression "expr"
@@ -751,8 +1146,20 @@ class Renderer(object):
         @raises: ReportError if the expression cannot be evaluated
         """
 
+        if environment.__class__ is Evaluated:
+            return environment.value
+        
+        code, constant = compile_expression(expr)
+        
+        # Constant expressions don't need any environment, and give always the same value
+        if constant:
+            try:
+                return _constants[expr]
+            except KeyError:
+                pass
+        
         loc = dict()
-        if hasattr(environment, "get_data"):
+        if not constant and hasattr(environment, "get_data"):
             loc.update(environment.get_data())
         
         glo = dict()
@@ -764,10 +1171,7 @@ class Renderer(object):
         glo['__builtins__'] = builtins
 
         try:
-            if "__import__" in expr:
-                raise ValueError("You cannot use __import__!")
-                
-            val = eval(expr, glo, loc)
+            val = eval(code, glo, loc)
         except AttributeError, err:
             e = err.args[0]
             i = e.find(" attribute ")
@@ -776,6 +1180,9 @@ class Renderer(object):
             raise ReportError(msg)
         except StandardError, e:
             raise ReportError(str(e))
+        
+        if constant:
+            _constants[expr] = val
             
         return val
     
@@ -847,37 +1254,56 @@ class Calculation(object):
         
         self.report = None
         
-    def reset(self):
+    def reset(self, context):
+        """
+        Resets the calculation
+        @param context: The RenderContext of the current run
+        """
         if self.startvalue is not None:
-            self.partial = self.startvalue
+            partial = self.startvalue
         else:
-            self.partial = None
+            partial = None
             
-        self.count = 0
+        context.calcs[self] = [partial, 0]
         
     def execute(self, renderer, environment):
-        self.count += 1
+        """
+        Updates the calculation with the current row
+        @param renderer: The renderer used to evaluate the calculation's value
+        @param environment: The environment data, a Data object
+        """
+        context = environment.context
+        state = context.calcs[self]
+        
+        state[1] += 1
         
         if not self.variable in self.report.variables.values():
             raise ReportError("Variable not found:"%self.variable)
         
         val = renderer.safe_eval(self.value, environment)
-        if self.partial is None:
-            self.partial = val
+        
+        # After a reset, the first value is the partial result
+        first = state[0] is None
+        if first:
+            state[0] = val
             
         if self.type == "sum":
-            self.partial += val
-            self.variable.value = self.partial
+            if not first:
+                state[0] += val
+            value = state[0]
         elif self.type == "avg":
-            self.partial += val
-            self.variable.value = self.partial/self.count
+            if not first:
+                state[0] += val
+            value = state[0]/state[1]
         elif self.type == "min":
-            if val < self.partial:
-                self.partial = val
-            self.variable.value = self.partial
+            if val < state[0]:
+                state[0] = val
+            value = state[0]
         elif self.type == "max":
-            if val > self.partial:
-                self.partial = val
-            self.variable.value = self.partial
+            if val > state[0]:
+                state[0] = val
+            value = state[0]
         elif self.type == "assign":
-            self.variable.value = val
\ No newline at end of file
+            value = val
+        
+        context.variables[self.variable.name] = value
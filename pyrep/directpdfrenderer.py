@@ -0,0 +1,78 @@
+# Copyright(c) 2005-2007 Angelantonio Valente (y3sman@gmail.com)
+# See LICENSE file for details.
+
+"""
+Direct PDF renderer
+Renders a report to a PDF file writing the page contents directly, without ReportLab's canvas.
+Only the standard 14 PDF fonts are available.
+"""
+
+from reportlab.lib.units import mm as rl_mm
+
+from base import *
+from pdfrenderer import PDFRenderer, GraphicsState
+from pdfwriter import Document, ContentStream, DEFAULT_COMPRESS_LEVEL
+
+class DirectPDFRenderer(PDFRenderer):
+    """
+    A PDF renderer writing the PDF operators of each page directly into its content stream.
+    Pages are written to the output file as soon as they are finished, as in PDFRenderer's
+    streaming mode. It's meant for high-volume runs, where the general-purpose canvas
+    is the main cost.
+    """
+
+    def render(self, *args, **kwargs):
+        """
+        Make a PDF file
+        @keyword outfile: Output file name or file object, if not given a temporary file will be created
+        @keyword output: "bytes" or "memoryview": the PDF data is returned instead of being written to a file.
+                         "chunks": an iterator of PDF data chunks is returned, each page yielded as soon as it's finished
+        @keyword show: If True, the generated PDF file will be shown with the  default system PDF reader
+        @keyword show_with: The complete path of the program to use to show the PDF
+        @keyword compress: If False, page contents won't be Flate-compressed (defaults to True)
+        @keyword compress_level: The zlib compression level, from 1 (fastest) to 9 (smallest). Defaults to 6
+        @keyword compress_workers: The number of threads compressing page contents while the next pages are drawn.
+                                   If 0 (the default), pages are compressed by the rendering thread
+        @return: The path of the new PDF file, the given file object, or the PDF data (look at the output keyword)
+        """
+        return super(DirectPDFRenderer, self).render(*args, **kwargs)
+
+    def _begin_document(self, outfile, options):
+        # Face resolution is limited to the standard fonts
+        self._streaming = True
+
+        self._document = Document(outfile, options.get("compress", True), options.get("compress_level", DEFAULT_COMPRESS_LEVEL),
+                                  options.get("compress_workers", 0))
+        self._pagesize = (rl_mm*self.report.page.width, rl_mm*self.report.page.height)
+
+        self._start_code()
+
+    def _end_document(self):
+        code = self._canvas.getCode()
+        if code:
+            self._document.add_page(code, self._pagesize)
+
+        self._document.close()
+
+    def _abort_document(self):
+        self._document.abort()
+
+    def _start_code(self):
+        """
+        Starts a new content stream, from the default graphics state. Every object is drawn
+        by PDFRenderer's methods, the content stream taking the canvas' place
+        """
+
+        self._canvas = ContentStream(self._document)
+        self._state = GraphicsState(self._canvas)
+
+    def finalize_page(self):
+        """
+        Called on page end
+        """
+        Renderer.finalize_page(self)
+
+        self._end_text()
+
+        self._document.add_page(self._canvas.getCode(), self._pagesize)
+        self._start_code()
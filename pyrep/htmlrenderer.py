@@ -6,11 +6,120 @@ HTML renderer
 Renders a report to a HTML file
 """
 
+import cgi
 import os
-import tempfile
 import sys
+import zlib
 
 from base import *
+import textlayout
+import images
+
+# Default size of the HTMLWriter's buffer, in bytes
+BUFFER_SIZE = 64 * 1024
+
+# Name of a page fragment file, in paged mode
+PAGE_FILE = "page-%d.html"
+
+# The viewer of the paged mode's index document: page fragments are fetched in order as 
+# the reader scrolls near the end of the loaded ones. A page not found (yet) is asked 
+# again on the next scroll, so the index can be read while the report is being rendered
+VIEWER = """<DIV id="pages"></DIV>
+<SCRIPT type="text/javascript">
+(function() {
+    var pages = document.getElementById("pages");
+    var next = 1;
+    var loading = false;
+    
+    function load() {
+        if (loading || pages.getBoundingClientRect().bottom > 2 * window.innerHeight) {
+            return;
+        }
+        
+        loading = true;
+        
+        var request = new XMLHttpRequest();
+        request.open("GET", "%(pages)s/page-" + next + ".html");
+        request.onreadystatechange = function() {
+            if (request.readyState != 4) {
+                return;
+            }
+            
+            loading = false;
+            
+            if (request.status == 200 || (request.status == 0 && request.responseText)) {
+                pages.insertAdjacentHTML("beforeend", request.responseText);
+                next++;
+                load();
+            }
+        };
+        request.send(null);
+    }
+    
+    window.onscroll = load;
+    window.onresize = load;
+    load();
+})();
+</SCRIPT>
+"""
+
+class HTMLWriter(object):
+    """
+    Collects the HTML code written by the renderer, and writes it to the output file 
+    in large blocks, optionally gzip-compressed on the fly.
+    """
+    
+    def __init__(self, out, buffer_size = BUFFER_SIZE, gzip = False, level = 6):
+        """
+        Constructor
+        @param out: The output file object
+        @param buffer_size: The amount of data collected before writing to the output file
+        @param gzip: If True, the output is gzip-compressed
+        @param level: The compression level, from 1 (fastest) to 9 (smallest)
+        """
+        
+        self.out = out
+        self.buffer_size = buffer_size
+        
+        self._buffer = list()
+        self._size = 0
+        
+        if gzip:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            self._compressor = None
+    
+    def write(self, data):
+        self._buffer.append(data)
+        self._size += len(data)
+        
+        if self._size >= self.buffer_size:
+            self._write_buffer()
+    
+    def _write_buffer(self, mode = None):
+        data = "".join(self._buffer)
+        self._buffer = list()
+        self._size = 0
+        
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+            if mode is not None:
+                data += self._compressor.flush(mode)
+        
+        if data:
+            self.out.write(data)
+    
+    def flush(self):
+        """
+        Writes the collected data, so that everything written so far can be decoded
+        """
+        self._write_buffer(zlib.Z_SYNC_FLUSH)
+    
+    def close(self):
+        """
+        Writes the collected data, and ends the compressed stream. The output file is not closed
+        """
+        self._write_buffer(zlib.Z_FINISH)
 
 class HTMLRenderer(Renderer):
     """
@@ -18,25 +127,94 @@ class HTMLRenderer(Renderer):
 	By now, it just doesn't work.
     """
     
+    # The output files' suffix
+    suffix = ".html"
+    
+    # The page fragments' directory, in paged mode
+    _pages_dir = None
+    
     def render(self, *args, **kwargs):
         """
         Make an HTML file 
-        @keyword outfile: Output file name, if not given a temporary file will be created
+        @keyword outfile: Output file name or file object, if not given a temporary file will be created
+        @keyword output: "bytes" or "memoryview": the HTML code is returned instead of being written to a file.
+                         "chunks": an iterator of HTML code chunks is returned, each page yielded as soon as it's finished
+        @keyword gzip: If True, the HTML code is gzip-compressed
+        @keyword buffer_size: The amount of HTML code collected before writing to the output file (defaults to 64 KB)
+        @keyword paged: If True, each page is written to its own fragment file as soon as it's finished, in the 
+                        <outfile name>_pages directory. outfile becomes a small viewer document, loading
+                        the pages as they are scrolled into view. Can't be used with the output and gzip keywords
         @keyword show: If True, the generated HTML file will be shown with the  default system HTML reader
         @keyword show_with: The complete path of the program to use to show the HTML 
-        @return: The path of the new HTML file
+        @return: The path of the new HTML file, the given file object, or the HTML code (look at the output keyword)
         """
         super(HTMLRenderer, self).render(*args, **kwargs)
         
+        self._pages_dir = None
+        
+        if kwargs.get("paged", False):
+            if kwargs.get("output", None) is not None or kwargs.get("gzip", False):
+                raise ReportError("Paged HTML output can't be used with the output and gzip keywords!")
+        
         # Open out file
-        if 'outfile' in kwargs:
-            outfile = kwargs['outfile']
-            out = os.open(outfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
-        else:
-            out = tempfile.mkstemp(".html","REP_")
-            outfile = out[1]
-            out = out[0]
+        out, outfile = self.open_output(self.suffix, **kwargs)
+        
+        if kwargs.get("paged", False):
+            if outfile is None:
+                raise ReportError("Paged HTML output needs an output file name!")
+            
+            self._pages_dir = self._open_pages_dir(outfile)
+        
+        if kwargs.get("output", None) == "chunks":
+            return self.render_chunks(out, kwargs)
 
+        self._begin_document(out, kwargs)
+        
+        self.report.process(self)
+        
+        self._end_document()
+        
+        result = self.close_output(out, outfile, **kwargs)
+        
+        if kwargs.get("show", False):
+            if outfile is None:
+                raise ReportError("Only a report rendered to a named file can be shown!")
+            
+            show_with = kwargs.get("show_with", "")
+            if not show_with:
+                if sys.platform == "darwin":
+                    os.system("open %s"%outfile)
+                elif sys.platform == "win32":
+                    os.startfile(outfile)
+                else:
+                    raise ReportError("Please pass the show_with parameter - No default HTML viewer!")
+                
+            else:
+                os.system("%s %s"%(show_with, outfile))
+        
+        return result
+    
+    def _open_pages_dir(self, outfile):
+        """
+        Returns the directory of the page fragments of outfile, created if missing.
+        The fragments of a previous render are removed
+        """
+        
+        path = os.path.splitext(outfile)[0] + "_pages"
+        
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError, e:
+                raise ReportError("Unable to create the pages directory <%s>.\n%s"%(path, e))
+        
+        for name in os.listdir(path):
+            if name.startswith("page-") and name.endswith(".html"):
+                os.remove(os.path.join(path, name))
+        
+        return path
+        
+    def _begin_document(self, out, options):
         header = """<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">
 
 <HTML>
@@ -45,50 +223,80 @@ class HTMLRenderer(Renderer):
         <STYLE type="text/css" media="all">
             @page {size: auto; margin: 0;}
             BODY {position: static;}
-            DIV.page {page-break-after: always; position: fixed;}
-            DIV.element {position: fixed;}
-            DIV.box {position: fixed;}
-            DIV.hline{position: fixed;}
-            DIV.vline{position: fixed;}
+            %(page)s
+            DIV.element {position: %(position)s;}
+            DIV.box {position: %(position)s;}
+            DIV.hline{position: %(position)s;}
+            DIV.vline{position: %(position)s;}
+            IMG.picture {position: %(position)s;}
+%(styles)s
         </STYLE>
     </HEAD>
     <BODY>
 """
 
-        os.write(out, header)
+        self._buffer_size = options.get("buffer_size", BUFFER_SIZE)
+        self.out = HTMLWriter(out, self._buffer_size, options.get("gzip", False))
         
-        self.out = out
-        self.report.process(self)
-
+        # When streaming chunks, each page must be readable as soon as it's finished
+        self._flush_pages = options.get("output", None) == "chunks"
+        
+        # Each distinct style becomes a CSS class, written once in the header
+        self._styles = dict()
+        self._classes = dict()
+        self._templates = dict()
+        self._header_written = False
+        
+        r = self.report
+        for section in (r.title, r.header, r.body, r.footer, r.summary):
+            for child in section.children:
+                self._get_template(child)
+        
+        styles = sorted(((name, style) for style, name in self._styles.items()), key = lambda x: int(x[0][1:]))
+        
+        styles = "\n".join("            .%s {%s}"%x for x in styles)
+        
+        if self._pages_dir is None:
+            self.out.write(header%dict(page = "DIV.page {page-break-after: always; position: fixed;}", position = "fixed",
+                                       styles = styles))
+        else:
+            # Pages are laid out one below the other, each one holding its elements
+            page = "DIV.page {page-break-after: always; position: relative; overflow: hidden; width: %smm; height: %smm; margin: 0 auto 5mm auto;}"%(
+                   self.report.page.width, self.report.page.height)
+            
+            self.out.write(header%dict(page = page, position = "absolute", styles = styles))
+            self.out.write(VIEWER%dict(pages = os.path.basename(self._pages_dir)))
+            
+            # The index is complete before the first page
+            self._close_document()
+            self._page_count = 0
+        
+        self._header_written = True
+        
+    def _end_document(self):
+        if self._pages_dir is None:
+            self._close_document()
+        
+    def _close_document(self):
         footer = """
     </BODY>
 </HTML>
 """
         
-        os.write(out, footer)
-        os.close(out)
+        self.out.write(footer)
+        self.out.close()
         
-        if kwargs.get("show", False):
-            show_with = kwargs.get("show_with", "")
-            if not show_with:
-                if sys.platform == "darwin":
-                    os.system("open %s"%outfile)
-                elif sys.platform == "win32":
-                    os.startfile(outfile)
-                else:
-                    raise ReportError("Please pass the show_with parameter - No default HTML viewer!")
-                
-            else:
-                os.system("%s %s"%(show_with, outfile))
-        
-        return outfile
-    
     def start_page(self):
         """
         Called on new page's begin
         """
         
-        os.write(self.out, """<DIV class="page">\n\n""")
+        if self._pages_dir is not None:
+            self._page_count += 1
+            self._page_file = open(os.path.join(self._pages_dir, PAGE_FILE%self._page_count) + ".tmp", "wb")
+            self.out = HTMLWriter(self._page_file, self._buffer_size)
+        
+        self.out.write("""<DIV class="page">\n\n""")
         
     def finalize_page(self):
         """
@@ -96,7 +304,19 @@ class HTMLRenderer(Renderer):
         """
         super(HTMLRenderer, self).finalize_page()
 
-        os.write(self.out, "\n\n</DIV>\n\n")
+        self.out.write("\n\n</DIV>\n\n")
+        
+        if self._pages_dir is not None:
+            self.out.close()
+            self._page_file.close()
+            
+            # Pages appear complete, so they can be served while the next ones are rendered
+            path = self._page_file.name[:-4]
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(self._page_file.name, path)
+        elif self._flush_pages:
+            self.out.flush()
 
     def _translate_coords(self, obj, x = None, y = None):
         """
@@ -110,7 +330,7 @@ class HTMLRenderer(Renderer):
             y = obj.y
 
         x += obj.parent.x
-        y = obj.parent.y + y
+        y = self.context.get_y(obj.parent) + y
 
         # if hasattr(obj, "font"):
         #     y -= obj.font.size
@@ -124,71 +344,157 @@ class HTMLRenderer(Renderer):
         info.append("font-size: %spt"%font.size)
         
         return ";".join(info)
+    
+    def _get_style(self, obj):
+        """
+        Returns the CSS declarations of an object's look (everything but its position and size)
+        @returns: A tuple of (element class, declarations)
+        """
         
-    def draw_text(self, text, environment = None):
+        if isinstance(obj, Text):
+            format = list()
+            if obj.alignment == Text.ALIGN_CENTER:
+                format.append("text-align: center")
+            elif obj.alignment == Text.ALIGN_RIGHT:
+                format.append("text-align: right")
+            
+            if obj.color is not None:
+                fc = obj.color.to_hex()
+            else:
+                fc = obj.parent.color.to_hex()
+            
+            format.append("color: %s"%fc)
+            format.append(self._get_font(obj.font))
+            
+            return "element", "; ".join(format)
+        
+        if isinstance(obj, HLine):
+            kind = "hline"
+        elif isinstance(obj, VLine):
+            kind = "vline"
+        elif isinstance(obj, Box):
+            kind = "box"
+        else:
+            return "picture", ""
+        
+        return kind, "border-width: %smm; border-style: solid; border-color: %s"%(obj.linewidth, obj.color.to_hex())
+    
+    def _get_class(self, obj):
         """
-        Draws a text object
+        Returns the CSS classes of an object: its element class, and the class generated for its style.
+        Computed once per object
         """
-
-        x, y = self._translate_coords(text)
         
-        txt = str(self.safe_eval(text.value, environment))
+        try:
+            return self._classes[obj]
+        except KeyError:
+            pass
+        
+        kind, style = self._get_style(obj)
+        if not style:
+            cls = self._classes[obj] = kind
+            return cls
+        
+        name = self._styles.get(style)
+        if name is None:
+            name = "s%d"%(len(self._styles) + 1)
+            self._styles[style] = name
+            
+            if self._header_written:
+                # An object unknown when the header was written
+                self.out.write("""<STYLE type="text/css">.%s {%s}</STYLE>\n"""%(name, style))
+        
+        cls = self._classes[obj] = "%s %s"%(kind, name)
+        return cls
         
-        format = []
-        align = ""
-        if text.alignment == Text.ALIGN_CENTER:
-            align = "text-align: center"
-        elif text.alignment == Text.ALIGN_RIGHT:
-            align = "text-align: right"
+    def _get_template(self, obj):
+        """
+        Returns the HTML code of an object as a format string, where only what changes on each 
+        draw is left out: the top coordinate, the text (and the height of stretching texts), 
+        or the picture's source. Computed once per object
+        """
         
-        format.append(align)
+        try:
+            return self._templates[obj]
+        except KeyError:
+            pass
         
-        if text.color is not None:
-            fc = text.color.to_hex()
+        cls = self._get_class(obj)
+        x = obj.x + obj.parent.x
+        
+        if isinstance(obj, Text):
+            if obj.stretch:
+                height = "%s"
+            else:
+                height = obj.height
+            
+            template = """<DIV class="%s" style="top: %%smm; left: %smm; width: %smm; height: %smm">%%s</DIV>\n"""%(
+                       cls, x, obj.width, height)
+        elif isinstance(obj, VLine):
+            template = """<DIV class="%s" style="top: %%smm; left: %smm; height: %smm; width: %smm">&nbsp</DIV>\n"""%(
+                       cls, x, obj.height, obj.linewidth/2)
+        elif isinstance(obj, HLine):
+            template = """<DIV class="%s" style="top: %%smm; left: %smm; width: %smm; height: %smm">&nbsp</DIV>\n"""%(
+                       cls, x, obj.width, obj.linewidth/2)
+        elif isinstance(obj, Box):
+            template = """<DIV class="%s" style="top: %%smm; left: %smm; width: %smm; height: %smm">&nbsp</DIV>\n"""%(
+                       cls, x, obj.width, obj.height)
         else:
-            fc = text.parent.color.to_hex()
-
-        format.append("color: %s"%fc)
+            template = """<IMG class="%s" style="top: %%smm; left: %smm; width: %smm; height: %smm" src="%%s" alt="">\n"""%(
+                       cls, x, obj.width, obj.height)
         
-        format.append(self._get_font(text.font))
+        self._templates[obj] = template
+        return template
         
-        format = ";".join(format)
+    def draw_text(self, text, environment = None):
+        """
+        Draws a text object
+        """
+
+        template = self._templates.get(text) or self._get_template(text)
+        y = self.context.get_y(text.parent) + text.y
         
-        div = """<DIV class="element" style="top: %smm; left: %smm; width: %smm; height: %smm; %s">%s</DIV>\n"""%(y, x, text.width, text.height, format, txt)
-        os.write(self.out, div)
+        if text.stretch:
+            lines = self.wrap_text(text, environment)
+            height = max(text.height, len(lines) * textlayout.line_height(text.font.size))
+            self.out.write(template%(y, height, "<BR>".join(cgi.escape(x) for x in lines)))
+        else:
+            self.out.write(template%(y, cgi.escape(str(self.safe_eval(text.value, environment)))))
         
     def draw_hline(self, shape, environment = None):
         """
         Draws an horizontal line
         """
 
-        x, y = self._translate_coords(shape)
-        
-        div = """<DIV class="hline" style="top: %smm; left: %smm; width: %smm; height: %smm; border-width: %smm; border-style: solid; border-color: %s">&nbsp</DIV>\n"""%(
-              y, x, shape.width, shape.linewidth/2, shape.linewidth, shape.color.to_hex())
-        
-        os.write(self.out, div)
+        template = self._templates.get(shape) or self._get_template(shape)
+        self.out.write(template%(self.context.get_y(shape.parent) + shape.y))
 
     def draw_vline(self, shape, environment = None):
         """
         Draws a vertical line
         """
 
-        x, y = self._translate_coords(shape)
-        
-        div = """<DIV class="vline" style="top: %smm; left: %smm; height: %smm; width: %smm; border-width: %smm; border-style: solid; border-color: %s">&nbsp</DIV>\n"""%(
-              y, x, shape.height, shape.linewidth/2, shape.linewidth, shape.color.to_hex())
-        
-        os.write(self.out, div)
+        template = self._templates.get(shape) or self._get_template(shape)
+        self.out.write(template%(self.context.get_y(shape.parent) + shape.y))
 
     def draw_box(self, box, environment = None):
         """
         Draws a box (may have rounded corners)
         """
         
-        x, y = self._translate_coords(box)
+        template = self._templates.get(box) or self._get_template(box)
+        self.out.write(template%(self.context.get_y(box.parent) + box.y))
+
+    def draw_picture(self, picture, environment = None):
+        """
+        Draws a picture. Image files are referenced by name, other images are embedded as data URIs
+        """
         
-        div = """<DIV class="box" style="top: %smm; left: %smm; width: %smm; height: %smm; border-width: %smm; border-style: solid; border-color: %s">&nbsp</DIV>\n"""%(
-              y, x, box.width, box.height, box.linewidth, box.color.to_hex())
+        source = self.safe_eval(picture.value, environment)
+        if images.is_file_name(source):
+            src = cgi.escape(source, True)
+        else:
+            src = images.load_image(source).get_data_uri()
         
-        os.write(self.out, div)
\ No newline at end of file
+        template = self._templates.get(picture) or self._get_template(picture)
+        self.out.write(template%(self.context.get_y(picture.parent) + picture.y, src))
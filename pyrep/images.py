@@ -0,0 +1,190 @@
+# Copyright(c) 2005-2007 Angelantonio Valente (y3sman@gmail.com)
+# See LICENSE file for details.
+
+"""
+Images.
+
+Pictures' images are decoded once and cached by content hash: the same image used
+by many objects, pages, renders or reports is read and decoded only once per process.
+Decoding needs the Python Imaging Library (PIL).
+"""
+
+import base64
+import hashlib
+import os
+import threading
+import zlib
+from cStringIO import StringIO
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+from base import ReportError
+
+# Maximum number of decoded images kept in cache
+IMAGE_CACHE_SIZE = 100
+
+class Image(object):
+    """
+    A decoded image. Its data is computed on first use and kept for the next ones.
+    @ivar digest: The SHA-1 hex digest of the image file's content
+    @ivar content: The image file's content
+    @ivar width: The width in pixels
+    @ivar height: The height in pixels
+    @ivar pil: The PIL image, in RGB (or RGBA if it has transparency) mode
+    """
+
+    def __init__(self, digest, content):
+        """
+        Constructor
+        @param digest: The SHA-1 hex digest of content
+        @param content: The image file's content
+        @raise ReportError: if the content isn't a valid image
+        """
+
+        self.digest = digest
+        self.content = content
+
+        try:
+            pil = PILImage.open(StringIO(content))
+            pil.load()
+        except Exception, e:
+            raise ReportError("Invalid image:\n%s"%e)
+
+        self.format = pil.format
+
+        if pil.mode in ("RGBA", "LA", "P") and (pil.mode != "P" or "transparency" in pil.info):
+            pil = pil.convert("RGBA")
+        elif pil.mode != "RGB":
+            pil = pil.convert("RGB")
+
+        self.pil = pil
+        self.width, self.height = pil.size
+
+        self._flate = None
+        self._data_uri = None
+
+    def get_flate(self):
+        """
+        Returns the Flate-compressed RGB samples and alpha channel (None if the image is opaque)
+        """
+
+        if self._flate is None:
+            if self.pil.mode == "RGBA":
+                rgb = self.pil.convert("RGB").tobytes()
+                alpha = zlib.compress(self.pil.split()[3].tobytes())
+            else:
+                rgb = self.pil.tobytes()
+                alpha = None
+
+            self._flate = (zlib.compress(rgb), alpha)
+
+        return self._flate
+
+    def get_data_uri(self):
+        """
+        Returns the image as a data: URI
+        """
+
+        if self._data_uri is None:
+            mime = "image/%s"%(self.format or "png").lower()
+            self._data_uri = "data:%s;base64,%s"%(mime, base64.b64encode(self.content))
+
+        return self._data_uri
+
+# Decoded images, by digest
+_images = dict()
+
+# Image files' digests, by path: (modification time, digest)
+_files = dict()
+
+_lock = threading.Lock()
+
+# Leading bytes of the image formats taken as binary data: PNG, JPEG, GIF and TIFF
+IMAGE_SIGNATURES = ("\x89PNG\r\n\x1a\n", "\xff\xd8\xff", "GIF87a", "GIF89a", "II*\0", "MM\0*")
+
+def is_file_name(source):
+    """
+    Returns True if an image source is a file name. A string starting with a known image
+    signature (look at IMAGE_SIGNATURES) is taken as the image's binary data
+    """
+    if isinstance(source, str):
+        return not source.startswith(IMAGE_SIGNATURES)
+    return isinstance(source, unicode)
+
+def read_source(source):
+    """
+    Returns the content of an image source
+    @param source: A file name, the image's binary data as a string (look at is_file_name),
+                   a buffer or a bytearray (as database blobs usually are), or a file-like object
+    @raise ReportError: if the source can't be read
+    """
+
+    if isinstance(source, (buffer, bytearray)) or (isinstance(source, str) and not is_file_name(source)):
+        return str(source)
+
+    if hasattr(source, "read"):
+        return source.read()
+
+    try:
+        f = open(source, "rb")
+        try:
+            return f.read()
+        finally:
+            f.close()
+    except (IOError, TypeError), e:
+        raise ReportError("Unable to read image <%s>.\n%s"%(source, e))
+
+def load_image(source):
+    """
+    Returns the (cached) decoded image of source
+    @param source: Look at read_source. An Image object is returned as is
+    @returns: An Image object
+    @raise ReportError: if the source can't be read or decoded, or PIL isn't available
+    """
+
+    if PILImage is None:
+        raise ReportError("The Python Imaging Library (PIL) is needed to draw pictures")
+
+    if isinstance(source, Image):
+        return source
+
+    filename = is_file_name(source)
+
+    digest = None
+    if filename:
+        # Files already seen aren't read again, unless they change
+        try:
+            mtime = os.path.getmtime(source)
+        except (OSError, TypeError, ValueError), e:
+            raise ReportError("Unable to read image <%s>.\n%s"%(source, e))
+
+        cached = _files.get(source)
+        if cached is not None and cached[0] == mtime:
+            digest = cached[1]
+
+    if digest is not None:
+        image = _images.get(digest)
+        if image is not None:
+            return image
+
+    content = read_source(source)
+    digest = hashlib.sha1(content).hexdigest()
+
+    if filename:
+        _files[source] = (mtime, digest)
+
+    _lock.acquire()
+    try:
+        image = _images.get(digest)
+        if image is None:
+            image = Image(digest, content)
+            if len(_images) >= IMAGE_CACHE_SIZE:
+                _images.clear()
+            _images[digest] = image
+    finally:
+        _lock.release()
+
+    return image
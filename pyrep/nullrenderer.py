@@ -0,0 +1,91 @@
+# Copyright(c) 2005-2007 Angelantonio Valente (y3sman@gmail.com)
+# See LICENSE file for details.
+
+"""
+Null renderer
+Processes a report as the real renderers do, without producing any output: it measures
+the engine's own work (pagination, expression evaluation, calculations).
+"""
+
+import collections
+import time
+
+from base import *
+
+class Timing(collections.namedtuple("Timing", "rows pages seconds")):
+    """
+    The timing of a run.
+    @ivar rows: The number of datasource records processed
+    @ivar pages: The number of pages
+    @ivar seconds: The elapsed time, in seconds
+    The rates are 0 if the run was too short to be timed.
+    """
+    __slots__ = ()
+
+    @property
+    def rows_per_second(self):
+        if not self.seconds:
+            return 0.0
+        return self.rows / float(self.seconds)
+
+    @property
+    def pages_per_second(self):
+        if not self.seconds:
+            return 0.0
+        return self.pages / float(self.seconds)
+
+class NullRenderer(Renderer):
+    """
+    A renderer discarding its output. Every object's position is resolved and every
+    expression is evaluated as by the real renderers, so a run costs what the engine costs.
+    Text is measured with the base Renderer's average glyph widths, so the pagination
+    of stretching texts may differ from the PDF renderers'.
+    """
+
+    def render(self, *args, **kwargs):
+        """
+        Process the report
+        @keyword timing: If True, the run's timing is returned
+        @return: The number of pages, or a Timing object (look at the timing keyword)
+        """
+
+        start = time.time()
+
+        super(NullRenderer, self).render(*args, **kwargs)
+
+        context = self.report.process(self)
+
+        elapsed = time.time() - start
+
+        if not kwargs.get("timing", False):
+            return context.pagenum
+
+        rows = max([r[1] for r in context.page_records if r] or [0])
+
+        return Timing(rows, context.pagenum, elapsed)
+
+    def _translate_coords(self, obj):
+        return (obj.x + obj.parent.x, self.context.get_y(obj.parent) + obj.y)
+
+    def draw_text(self, text, environment = None):
+        self._translate_coords(text)
+
+        if text.stretch:
+            self.wrap_text(text, environment)
+        else:
+            str(self.safe_eval(text.value, environment))
+
+    def draw_hline(self, shape, environment = None):
+        self._translate_coords(shape)
+
+    def draw_vline(self, shape, environment = None):
+        self._translate_coords(shape)
+
+    def draw_box(self, box, environment = None):
+        self._translate_coords(box)
+
+    def draw_picture(self, picture, environment = None):
+        self._translate_coords(picture)
+
+        # The image itself isn't loaded
+        self.safe_eval(picture.value, environment)
@@ -6,8 +6,9 @@
 """
 
 import logging
+import os
 
-import xml.dom.minidom
+import xml.parsers.expat
 
 import dataproviders
 
@@ -18,11 +19,15 @@ class XMLParser(object):
     """
         Parses an XML report definition file.
         Look at the report.dtd for XML schema
+        
+        The file is parsed as a stream of events: the report's objects are built as their 
+        elements are read, without keeping a document tree in memory.
     """
     
     def __init__(self, **kwargs):
         """
-        Constructor. "filename" parameter take precedence over "xmlcontent"
+        Constructor. If both are given, "xmlcontent" is parsed: the file's name is only used
+        in error messages and to find the font files relatively to it
          
         @param filename: File's name
         @param xmlcontent: XML code
@@ -33,6 +38,9 @@ class XMLParser(object):
         
         if self._filename is None and self._xmlcontent is None:
             raise ReportError("Please pass a file name or an xml content to parse!")
+        
+        # Parsed numbers, by (value, parse_unit)
+        self._numbers = dict()
     
     def parse(self):
         """
@@ -40,80 +48,172 @@ class XMLParser(object):
         @returns: a Report object
         """
         
+        self.rpt = None
+        
+        # The open elements: a list of (name, attributes, text) tuples. text collects the 
+        # element's text nodes, when it's needed (look at _text_node)
+        self._stack = list()
+        self._chars = list()
+        self._in_cdata = False
+        
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        parser.CharacterDataHandler = self._character_data
+        parser.StartCdataSectionHandler = self._start_cdata
+        parser.EndCdataSectionHandler = self._end_cdata
+        
+        # Comments and processing instructions end a text node
+        parser.CommentHandler = lambda data: self._text_node()
+        parser.ProcessingInstructionHandler = lambda target, data: self._text_node()
+        
+        from_file = self._xmlcontent is None
+        
+        if from_file:
+            # Open XML file 
+            try:
+                f = open(self._filename, "rb")
+            except IOError, e:
+                raise ReportError("Parsing error:\nUnable to open report file <%s>.\n%s"%(self._filename, e))
+        
         try:
-            if self._filename:
-                # Open XML file 
-                try:
-                    f = open(self._filename, "rb")
-                except IOError, e:
-                    raise ReportError("Unable to open report file <%s>.\n%s"%(self._filename, e))
-                
-                content = xml.dom.minidom.parse(f)
-            else:
-                content = xml.dom.minidom.parseString(self._xmlcontent)
-        except Exception, e:
-            raise ReportError("Parsing error:\n%s"%e)
-            
-        report = content.documentElement
-        # Check out XML schema
-        if report.nodeName != "report":
-            raise ReportError("%s: Invalid report file! Root element is <%s>"%(self._filename, report.nodeName))
+            try:
+                if from_file:
+                    parser.ParseFile(f)
+                else:
+                    parser.Parse(self._xmlcontent, True)
+            except (xml.parsers.expat.ExpatError, IOError), e:
+                raise ReportError("Parsing error:\n%s"%e)
+        finally:
+            if from_file:
+                f.close()
         
-        # Builds the Report object
-        self.rpt=Report()
-
-        # Analyze report's attributes
-        if report.hasAttribute("pagesize"):
-            report.page = Page(report.getAttribute("pagesize"))
-        if report.hasAttribute("renderer"):
-            renderer = report.getAttribute("renderer")
-            logging.warn("Preferred renderer not implemented yet!")
-
-        # Start processing of top-level elements
-        for element in report.childNodes:
-            if element.nodeType != element.ELEMENT_NODE:
-                continue
+        return self.rpt
+    
+    def _text_node(self):
+        """
+        Ends the current text node: its content is added to the texts of the current element, 
+        if it collects them
+        """
+        
+        if self._chars:
+            text = self._stack[-1][2]
+            if text is not None:
+                text.append("".join(self._chars))
+            self._chars = list()
+    
+    def _character_data(self, data):
+        # CDATA sections aren't text nodes
+        if not self._in_cdata:
+            self._chars.append(data)
+    
+    def _start_cdata(self):
+        self._text_node()
+        self._in_cdata = True
+    
+    def _end_cdata(self):
+        self._in_cdata = False
+    
+    def _start_element(self, name, attrs):
+        if self._stack:
+            self._text_node()
+        
+        depth = len(self._stack)
+        text = None
+        
+        if depth == 0:
+            # Check out XML schema
+            if name != "report":
+                raise ReportError("%s: Invalid report file! Root element is <%s>"%(self._filename, name))
+            
+            # Builds the Report object
+            self.rpt=Report()
             
-            name = element.nodeName
+            # Analyze report's attributes
+            if "pagesize" in attrs:
+                # Checked, but not applied to the report yet
+                Page(attrs["pagesize"])
+            if "renderer" in attrs:
+                logging.warn("Preferred renderer not implemented yet!")
             
+        elif depth == 1:
+            # Top-level elements
             if name == "font":
-                self._parse_font(element)
+                self._parse_font(attrs)
             elif name in "title,header,body,footer,summary".split(","):
-                self._process_section(element)
+                self._process_section(name, attrs)
             elif name == "datasources":
-                self._process_datasources(element)
+                pass
+            elif name == "parameter":
+                self._parse_parameter(attrs)
             else:
                 logging.warn("Invalid element in report definition file: %s"%name)
-                
-        
-        return self.rpt
             
+        elif depth == 2:
+            parent = self._stack[1][0]
+            
+            if parent in ("title", "header", "body", "footer", "summary"):
+                if hasattr(self, "_process_child_%s"%name):
+                    text = list()
+                else:
+                    logging.warn("Invalid child type: %s"%name)
+            elif parent == "datasources":
+                if name == "datasource":
+                    text = list()
+                else:
+                    logging.warn("Invalid child for datasources: %s"%name)
+        
+        self._stack.append((name, attrs, text))
     
-    def _parse_font(self, element):
+    def _end_element(self, name):
+        self._text_node()
+        
+        name, attrs, text = self._stack.pop()
+        
+        if text is None:
+            return
+        
+        # Section children and datasources are built when their text is complete
+        parent = self._stack[-1][0]
+        
+        if parent == "datasources":
+            self._process_datasource(attrs, text)
+        else:
+            getattr(self, "_process_child_%s"%name)(getattr(self.rpt, parent), attrs, text)
+    
+    def _parse_font(self, attrs):
         id = None
         size = None
         italic = False
         bold = False
         
-        if element.hasAttribute("id"):
-            id = element.getAttribute("id")
+        if "id" in attrs:
+            id = attrs["id"]
             
-        if element.hasAttribute("face"):
-            face = element.getAttribute("face")
+        if "face" in attrs:
+            face = attrs["face"]
         else:
             raise ReportError("Font face not specified")
         
-        if element.hasAttribute("size"):
-            size = int(element.getAttribute("size"))
+        if "size" in attrs:
+            size = int(attrs["size"])
             if size <= 0:
                 raise ReportError("Invalid font size!")
         else:
             raise ReportError("Font size not specified")
         
-        if element.hasAttribute("italic"):
-            if element.getAttribute("italic").lower() == "true":
+        filename = None
+        if "file" in attrs:
+            filename = attrs["file"]
+            if self._filename and not os.path.isabs(filename):
+                # Relative to the report definition file
+                filename = os.path.join(os.path.dirname(self._filename), filename)
+        
+        if "italic" in attrs:
+            if attrs["italic"].lower() == "true":
                 italic = True
-            if element.getAttribute("bold").lower() == "true":
+            if attrs.get("bold", "").lower() == "true":
                 bold = True
             
         style = list()
@@ -124,35 +224,38 @@ class XMLParser(object):
             
         f = Font(id, face, size, style)
             
-        self.rpt.register_font(f)
-        
-    def _process_section(self, element):
-        section = getattr(self.rpt, element.nodeName)
+        self.rpt.register_font(f, filename)
         
-        section.size = self.get_size(element)
+    def _parse_parameter(self, attrs):
+        if not "name" in attrs:
+            raise ReportError("Parameter name not specified")
         
-        if element.hasAttribute("font"):
-            section.default_font = self.rpt.get_font(element.getAttribute("font"))
+        if not "type" in attrs:
+            raise ReportError("Parameter type not specified")
         
-        # Process children
-        for child in element.childNodes:
-            if child.nodeType != child.ELEMENT_NODE:
-                continue
+        value = None
+        if "value" in attrs:
+            value = attrs["value"]
             
-            name = child.nodeName
-            
-            if hasattr(self,"_process_child_%s"%name):
-                getattr(self,"_process_child_%s"%name)(section, child)
-            else:
-                logging.warn("Invalid child type: %s"%name)
+        p = Parameter(attrs["name"], attrs["type"], value)
+        
+        self.rpt.add_parameter(p)
+        
+    def _process_section(self, name, attrs):
+        section = getattr(self.rpt, name)
+        
+        section.size = self.get_size(attrs)
+        
+        if "font" in attrs:
+            section.default_font = self.rpt.get_font(attrs["font"])
                 
-    def _process_child_text(self, section, element):
-        size = self.get_size(element)
-        position = self.get_position(element)
+    def _process_child_text(self, section, attrs, text):
+        size = self.get_size(attrs)
+        position = self.get_position(attrs)
         align = Text.ALIGN_LEFT
         
-        if element.hasAttribute("alignment"):
-            a = element.getAttribute("alignment")
+        if "alignment" in attrs:
+            a = attrs["alignment"]
             if a == "left":
                 align = Text.ALIGN_LEFT
             elif a == "center":
@@ -162,53 +265,65 @@ class XMLParser(object):
             else:
                 logging.warn("Invalid alignment: %s"%a)
         
-        value=[]
-        for child in element.childNodes:
-            if child.nodeType == child.TEXT_NODE:
-                value.append(child.nodeValue.strip())
-        value = "\n".join(value)
+        value = "\n".join(x.strip() for x in text)
 
         kwargs = dict( value = value, alignment = align)
 
-        if element.hasAttribute("font"):
-            kwargs["font"] = self.rpt.get_font(element.getAttribute("font"))
+        if "font" in attrs:
+            kwargs["font"] = self.rpt.get_font(attrs["font"])
+
+        if "color" in attrs:
+            kwargs["color"] = Color.from_hex(attrs["color"])
 
-        if element.hasAttribute("color"):
-            kwargs["color"] = Color.from_hex(element.getAttribute("color"))
+        if "stretch" in attrs:
+            kwargs["stretch"] = attrs["stretch"].lower() == "true"
+
+        if "ellipsis" in attrs:
+            kwargs["ellipsis"] = attrs["ellipsis"].lower() == "true"
 
         text = Text(size, **kwargs)
         
         section.add_child(position, text)
     
-    def _process_child_hline(self, section, element):
-        position = self.get_position(element)
-        size = self.get_size(element)
+    def _process_child_picture(self, section, attrs, text):
+        size = self.get_size(attrs)
+        position = self.get_position(attrs)
+        
+        value = "".join(x.strip() for x in text)
+        
+        picture = Picture(size, value = value)
+        
+        section.add_child(position, picture)
+    
+    def _process_child_hline(self, section, attrs, text):
+        position = self.get_position(attrs)
+        size = self.get_size(attrs)
         
         line = HLine(size[0])
         
         section.add_child(position, line)            
 
-    def _process_child_box(self, section, element):
-        position = self.get_position(element)
-        size = self.get_size(element)
+    def _process_child_box(self, section, attrs, text):
+        position = self.get_position(attrs)
+        size = self.get_size(attrs)
 
-        if element.hasAttribute("linewidth"):
-            linewidth = self.parse_number(element.getAttribute("linewidth"))
+        if "linewidth" in attrs:
+            linewidth = self.parse_number(attrs["linewidth"])
         else:
             linewidth = 0.2
 
-        if element.hasAttribute("bordercolor"):
-            bordercolor = Color.from_hex(element.getAttribute("bordercolor"))
+        if "bordercolor" in attrs:
+            bordercolor = Color.from_hex(attrs["bordercolor"])
         else:
             bordercolor = Color.BLACK
 
-        if element.hasAttribute("fillcolor"):
-            fillcolor = Color.from_hex(element.getAttribute("fillcolor"))
+        if "fillcolor" in attrs:
+            fillcolor = Color.from_hex(attrs["fillcolor"])
         else:
             fillcolor = Color.WHITE
 
-        if element.hasAttribute("round"):
-            round = self.parse_number(element.getAttribute("round"), False)
+        if "round" in attrs:
+            round = self.parse_number(attrs["round"], False)
         else:
             round = 0
             
@@ -216,51 +331,36 @@ class XMLParser(object):
 
         section.add_child(position, box)
 
-    def _process_datasources(self, element):
-        # Process children
-        for datasource in element.childNodes:
-            if datasource.nodeType != datasource.ELEMENT_NODE:
-                continue
-            
-            name = datasource.nodeName
-            
-            if name != "datasource":
-                logging.warn("Invalid child for datasources: %s"%name)
-                continue
-            
-            dsname = datasource.getAttribute("name")
-            dstype = datasource.getAttribute("type")
-            dsengine = datasource.getAttribute("engine")
-            
-            if dstype == "dbapi2":
-                dsquery=[]
-                for line in datasource.childNodes:
-                    if line.nodeType == line.TEXT_NODE:
-                        dsquery.append(line.nodeValue.strip())
-                dsquery = "\n".join(dsquery)
-                    
-                ds = dataproviders.DBDataProvider(dsquery)
-                self.rpt.datasources[dsname] = ds
+    def _process_datasource(self, attrs, text):
+        dsname = attrs.get("name", "")
+        dstype = attrs.get("type", "")
+        dsengine = attrs.get("engine", "")
+        
+        if dstype == "dbapi2":
+            dsquery = "\n".join(x.strip() for x in text)
+                
+            ds = dataproviders.DBDataProvider(dsquery)
+            self.rpt.datasources[dsname] = ds
             
-    def get_size(self, element):
+    def get_size(self, attrs):
         w, h = -1, -1
         
-        if element.hasAttribute("width"):
-            w = self.parse_number(element.getAttribute("width"))
+        if "width" in attrs:
+            w = self.parse_number(attrs["width"])
             
-        if element.hasAttribute("height"):
-            h = self.parse_number(element.getAttribute("height"))
+        if "height" in attrs:
+            h = self.parse_number(attrs["height"])
         
         return w, h
     
-    def get_position(self, element):
+    def get_position(self, attrs):
         x, y = 0, 0
         
-        if element.hasAttribute("x"):
-            x = self.parse_number(element.getAttribute("x"))
+        if "x" in attrs:
+            x = self.parse_number(attrs["x"])
 
-        if element.hasAttribute("y"):
-            y = self.parse_number(element.getAttribute("y"))
+        if "y" in attrs:
+            y = self.parse_number(attrs["y"])
         
         return x, y
 
@@ -278,6 +378,13 @@ class XMLParser(object):
             return None
         if value == "all":
             return None
+        
+        # Templates repeat the same values over and over
+        key = (value, parse_unit)
+        try:
+            return self._numbers[key]
+        except KeyError:
+            pass
             
         n=""
         m=""
@@ -311,4 +418,6 @@ class XMLParser(object):
         if not m in units:
             raise ReportError("Invalid unit: %s"%m)
         
-        return units[m](n)
+        n = self._numbers[key] = units[m](n)
+        
+        return n
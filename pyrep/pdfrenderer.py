@@ -7,49 +7,204 @@ Renders a report to a PDF file using the ReportLab library (www.reportlab.org)
 """
 
 import os
-import tempfile
 import sys
+import threading
 
 from reportlab.pdfgen import canvas
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.units import mm as rl_mm
+from reportlab.lib.utils import ImageReader
 
 from base import *
+import textlayout
+import pdfwriter
+import images
+
+# Maximum number of font subsets kept in cache, for each TrueType face
+SUBSET_CACHE_SIZE = 100
+
+# Loaded TrueType fonts, by face name: (file path, TTFont object)
+_truetype = dict()
+_truetype_lock = threading.Lock()
+
+def load_truetype(face, filename):
+    """
+    Loads a TrueType font and registers it with ReportLab. Each file is parsed only once
+    per process: later renders (of any report) share the parsed font, its glyph tables 
+    and the subsets already built. ReportLab embeds only the glyphs actually used.
+    @param face: The face name to register the font with
+    @param filename: The TrueType font file
+    @returns: The TTFont object
+    @raise ReportError: If the file can't be loaded, or the face is already registered from another file
+    """
+    
+    path = os.path.abspath(filename)
+    
+    _truetype_lock.acquire()
+    try:
+        if face in _truetype:
+            registered, font = _truetype[face]
+            if registered != path:
+                raise ReportError("Font face %s is already registered from %s"%(face, registered))
+            return font
+        
+        try:
+            font = TTFont(face, path)
+        except Exception, e:
+            raise ReportError("Unable to load TrueType font <%s>.\n%s"%(filename, e))
+        
+        _cache_subsets(font.face)
+        pdfmetrics.registerFont(font)
+        
+        _truetype[face] = (path, font)
+        
+        return font
+    finally:
+        _truetype_lock.release()
+
+def _cache_subsets(face):
+    """
+    Makes a TrueType face remember the subsets it builds, so that documents using 
+    the same glyphs don't build them again
+    @param face: A TTFontFace object
+    """
+    
+    make_subset = face.makeSubset
+    subsets = dict()
+    
+    def cached_subset(subset):
+        key = tuple(subset)
+        try:
+            return subsets[key]
+        except KeyError:
+            if len(subsets) >= SUBSET_CACHE_SIZE:
+                subsets.clear()
+            data = subsets[key] = make_subset(subset)
+            return data
+    
+    face.makeSubset = cached_subset
+
+class GraphicsState(object):
+    """
+    Keeps track of the canvas' current font, colours and line width, so that only the 
+    operators actually changing the graphics state are emitted.
+    Colours are given as Color objects (or (r, g, b) sequences in 0-255 range).
+    Font and fill colour may be set inside a text object, by passing it as the target.
+    """
+    
+    def __init__(self, canvas):
+        """
+        Constructor
+        @param canvas: The canvas (or pdfwriter.ContentStream) to set the state on
+        """
+        self.canvas = canvas
+        self.reset()
+    
+    def reset(self):
+        """
+        Forgets the current state. To be called on each new page, since its state starts from the defaults
+        """
+        self.font = None
+        self.fill_color = None
+        self.stroke_color = None
+        self.line_width = None
+    
+    def set_font(self, face, size, target = None):
+        if self.font != (face, size):
+            if target is None:
+                target = self.canvas
+            target.setFont(face, size)
+            self.font = (face, size)
+    
+    def set_fill_color(self, color, target = None):
+        rgb = tuple(color)
+        if self.fill_color != rgb:
+            if target is None:
+                target = self.canvas
+            target.setFillColorRGB(*[x / 255.0 for x in rgb])
+            self.fill_color = rgb
+    
+    def set_stroke_color(self, color):
+        rgb = tuple(color)
+        if self.stroke_color != rgb:
+            self.canvas.setStrokeColorRGB(*[x / 255.0 for x in rgb])
+            self.stroke_color = rgb
+    
+    def set_line_width(self, width):
+        if self.line_width != width:
+            self.canvas.setLineWidth(width)
+            self.line_width = width
 
 class PDFRenderer(Renderer):
     """
     Renderer class.
     """
+    
+    # The output files' suffix
+    suffix = ".pdf"
+    
+    def __init__(self, report):
+        super(PDFRenderer, self).__init__(report)
+        
+        # Resolved fonts, by Font object
+        self._fonts = dict()
+        
+        # Form XObjects drawing the images, by image digest
+        self._image_forms = dict()
+        
+        # The pending text object, and the start of its current line
+        self._text = None
+        self._text_pos = None
+        
+        self._streaming = False
         
     def render(self, *args, **kwargs):
         """
         Make a PDF file 
-        @keyword outfile: Output file name, if not given a temporary file will be created
+        @keyword outfile: Output file name or file object, if not given a temporary file will be created
+        @keyword output: "bytes" or "memoryview": the PDF data is returned instead of being written to a file.
+                         "chunks": an iterator of PDF data chunks is returned. In streaming mode, each page
+                         is yielded as soon as it's finished
         @keyword show: If True, the generated PDF file will be shown with the  default system PDF reader
         @keyword show_with: The complete path of the program to use to show the PDF 
-        @return: The path of the new PDF file
+        @keyword streaming: If True, each page is written to the output file as soon as it's finished, 
+                            so memory usage doesn't grow with the number of pages. Only the standard 
+                            PDF fonts can be used in this mode
+        @keyword compress_level: The zlib compression level of page contents in streaming mode, from 1 (fastest)
+                                 to 9 (smallest). Defaults to 6
+        @keyword compress_workers: The number of threads compressing page contents in streaming mode. 
+                                   If 0 (the default), pages are compressed by the rendering thread
+        @return: The path of the new PDF file, the given file object, or the PDF data (look at the output keyword)
         """
         super(PDFRenderer, self).render(*args, **kwargs)
         
         # Open out file
-        if 'outfile' in kwargs:
-            outfile = kwargs['outfile']
-        else:
-            out = tempfile.mkstemp(".pdf","REP_")
-            os.close(out[0])
-            outfile = out[1]
+        out, outfile = self.open_output(self.suffix, **kwargs)
             
-        c=canvas.Canvas(outfile)
-
-        # Set Page Size
-        c.setPageSize((rl_mm*self.report.page.width,rl_mm*self.report.page.height,))
+        # Fonts are resolved again on each render
+        self._fonts = dict()
+        self._image_forms = dict()
         
-        self._canvas=c
+        if kwargs.get("output", None) == "chunks":
+            return self.render_chunks(out, kwargs)
+        
+        self._begin_document(out, kwargs)
 
-        self.report.process(self)
+        try:
+            self.report.process(self)
+        except:
+            self._abort_document()
+            raise
         
-        c.save()
+        self._end_document()
+        
+        result = self.close_output(out, outfile, **kwargs)
         
         if kwargs.get("show", False):
+            if outfile is None:
+                raise ReportError("Only a report rendered to a named file can be shown!")
+            
             show_with = kwargs.get("show_with", "")
             if not show_with:
                 if sys.platform == "darwin":
@@ -62,15 +217,41 @@ class PDFRenderer(Renderer):
             else:
                 os.system("%s %s"%(show_with, outfile))
         
-        return outfile
+        return result
     
+    def _begin_document(self, outfile, options):
+        
+        self._streaming = options.get("streaming", False)
+        
+        if self._streaming:
+            c=pdfwriter.Canvas(outfile, level = options.get("compress_level", pdfwriter.DEFAULT_COMPRESS_LEVEL),
+                               workers = options.get("compress_workers", 0))
+        else:
+            c=canvas.Canvas(outfile)
+
+        # Set Page Size
+        c.setPageSize((rl_mm*self.report.page.width,rl_mm*self.report.page.height,))
+        
+        self._canvas=c
+        self._state=GraphicsState(c)
+        
+    def _end_document(self):
+        self._canvas.save()
+        
+    def _abort_document(self):
+        # ReportLab's canvas holds nothing but memory
+        if self._streaming:
+            self._canvas.abort()
+        
     def finalize_page(self):
         """
         Called on page end
         """
         super(PDFRenderer, self).finalize_page()
 
+        self._end_text()
         self._canvas.showPage()
+        self._state.reset()
         
     def _translate_coords(self, obj, x = None, y = None):
         """
@@ -84,10 +265,10 @@ class PDFRenderer(Renderer):
             y = obj.y
             
         x += obj.parent.x
-        y = self.report.page.height - obj.parent.y - y
+        y = self.report.page.height - self.context.get_y(obj.parent) - y
         
         if hasattr(obj, "font"):
-            y -= obj.font.size / rl_mm
+            y -= self.resolve_font(obj.font).ascent / rl_mm
 
         return tuple(n*rl_mm for n in (x,y))
     
@@ -113,29 +294,103 @@ class PDFRenderer(Renderer):
 
         return ret
         
-    def _set_font(self, font):
+    def _set_font(self, font, target = None):
         """
         Sets the current font
+        @param target: The text object to set the font in. If None, the font is set on the canvas
+        @returns: The ResolvedFont set
         """
+        
+        resolved = self.resolve_font(font)
+        self._state.set_font(resolved.face, resolved.size, target)
+        
+        return resolved
+    
+    def _begin_text(self):
+        """
+        Returns the pending text object, creating it if needed. Consecutive texts are 
+        collected in the same text object, positioned relatively to each other
+        """
+        
+        if self._text is None:
+            self._text = self._canvas.beginText()
+            self._text_pos = (0, 0)
+            
+            # The font must be set in each text object: ReportLab needs it to encode the text
+            self._state.font = None
+            
+        return self._text
+    
+    def _end_text(self):
+        """
+        Draws the pending text object, if any. Must be called before drawing anything else, 
+        to keep the drawing order
+        """
+        
+        if self._text is not None:
+            self._canvas.drawText(self._text)
+            self._text = None
 
+    def _resolve_face(self, font):
+        """
+        Returns the name of the first available face of the font
+        """
+        
+        files = self.report.font_files
+        
         for face in font.faces:
+            if face in files:
+                # TrueType faces can't be used by the streaming canvas
+                if self._streaming:
+                    continue
+                
+                load_truetype(face, files[face])
+                return face
+            
+            if Font.BOLD in font.style and Font.ITALIC in font.style:
+                face+="-BoldOblique"
+            elif Font.BOLD in font.style:
+                face+="-Bold"
+            elif Font.ITALIC in font.style:
+                face+="-Oblique"
+            
+            if self._streaming and face not in pdfwriter.STANDARD_FONTS:
+                continue
+            
             try:
-                if Font.BOLD and Font.ITALIC in font.style:
-                    face+="-BoldOblique"
-                elif Font.BOLD in font.style:
-                    face+="-Bold"
-                elif Font.ITALIC in font.style:
-                    face+="-Oblique"
-                    
-                self._canvas.setFont(face,font.size)
+                pdfmetrics.getFont(face)
             except KeyError:
                 continue
             else:
-                font.face=face
-                break
+                return face
         else:
             raise ReportError("No available fonts. Font list: %s"%font.faces)
-
+    
+    def resolve_font(self, font):
+        """
+        Returns the font's face and metrics. Each font is resolved only once per render
+        @param font: A Font object
+        @returns: A textlayout.ResolvedFont object
+        """
+        
+        resolved = self._fonts.get(font)
+        if resolved is None:
+            face = self._resolve_face(font)
+            metrics = pdfmetrics.getFont(face).face
+            widths = textlayout.get_glyph_widths(face, lambda c: pdfmetrics.stringWidth(c, face, 1000))
+            
+            resolved = textlayout.ResolvedFont(face, font.size, metrics.ascent * font.size / 1000.0, 
+                                               metrics.descent * font.size / 1000.0, widths)
+            self._fonts[font] = resolved
+            
+        return resolved
+    
+    def get_glyph_widths(self, font):
+        """
+        Returns the glyph width table of the font, measured with ReportLab's font metrics
+        """
+        return self.resolve_font(font).widths
+        
     def draw_text(self, text, environment = None):
         """
         Draws a text object
@@ -143,105 +398,144 @@ class PDFRenderer(Renderer):
         
         x, y = self._translate_coords(text)
         
-        txt = str(self.safe_eval(text.value, environment))
+        if text.stretch:
+            lines = self.wrap_text(text, environment)
+        else:
+            lines = [str(self.safe_eval(text.value, environment))]
         
-        self._canvas.saveState()
+        t = self._begin_text()
         
-        self._set_font(text.font)
+        font = self._set_font(text.font, t)
         
         fc = text.color
         if fc is None:
             fc = text.parent.color
         
-        self._canvas.setFillColorRGB(*self._translate_color(fc))
-
-        # TODO: Find a better way to do it
-        if text.width:
-            length = self._canvas.stringWidth(txt, text.font.face, text.font.size)
-            while length > text.width * rl_mm:
-                txt = txt[:-1]
-                length = self._canvas.stringWidth(txt, text.font.face, text.font.size)
+        self._state.set_fill_color(fc, t)
 
-        if text.alignment == Text.ALIGN_LEFT:
-            self._canvas.drawString(x,y,txt)
-        elif text.alignment == Text.ALIGN_CENTER:
-            self._canvas.drawCentredString(x + (text.width * rl_mm * 0.5), y, txt)
-        elif text.alignment == Text.ALIGN_RIGHT:
-            self._canvas.drawRightString( x + text.width * rl_mm, y, txt)
+        width = text.width * rl_mm
         
-        self._canvas.restoreState()
+        if text.width and not text.stretch:
+            lines[0] = textlayout.fit_text(lines[0], font.widths, font.size, width, text.ellipsis)
+        
+        leading = textlayout.line_height(font.size) * rl_mm
+        
+        for txt in lines:
+            if text.alignment == Text.ALIGN_LEFT:
+                lx = x
+            elif text.alignment == Text.ALIGN_CENTER:
+                lx = x + (width - font.widths.string_width(txt, font.size)) * 0.5
+            elif text.alignment == Text.ALIGN_RIGHT:
+                lx = x + width - font.widths.string_width(txt, font.size)
+            
+            # Move relatively to the previous line's start
+            px, py = self._text_pos
+            t.moveCursor(lx - px, py - y)
+            self._text_pos = (lx, y)
+            
+            t.textOut(txt)
+            
+            y -= leading
         
     def draw_hline(self, shape, environment = None):
         """
         Draws an horizontal line
         """
+
+        self._end_text()
         
         x, y = self._translate_coords(shape)
-        x2, y2 = self._translate_coords(shape, (x + shape.width), y)
-
-        self._canvas.saveState()
+        x2 = x + shape.width * rl_mm
 
         if shape.color is None:
             fc = shape.parent.color
         else:
             fc = shape.color
             
-        self._canvas.setStrokeColorRGB(*self._translate_color(fc))
+        self._state.set_stroke_color(fc)
 
-        self._canvas.setLineWidth(shape.linewidth * rl_mm)
+        self._state.set_line_width(shape.linewidth * rl_mm)
         
         self._canvas.line(x, y, x2, y)
 
-        self._canvas.restoreState()
-
     def draw_vline(self, shape, environment = None):
         """
         Draws a vertical line
         """
 
+        self._end_text()
+
         x, y = self._translate_coords(shape)
         x2, y2 = self._translate_coords(shape, shape.x, (shape.y + shape.height) )
 
-        self._canvas.saveState()
-
         if shape.color is None:
             fc = shape.parent.color
         else:
             fc = shape.color
             
-        self._canvas.setStrokeColorRGB(*self._translate_color(fc))
+        self._state.set_stroke_color(fc)
         
-        self._canvas.setLineWidth(shape.linewidth * rl_mm)
+        self._state.set_line_width(shape.linewidth * rl_mm)
 
         self._canvas.line(x, y, x, y2)
-        
-        self._canvas.restoreState()
 
     def draw_box(self, box, environment = None):
         """
         Draws a box (may have rounded corners)
         """
+
+        self._end_text()
         
         x, y = self._translate_coords(box)
         
-        self._canvas.saveState()
-        
-        self._canvas.setLineWidth(box.linewidth * rl_mm)
+        self._state.set_line_width(box.linewidth * rl_mm)
         
         if box.backcolor is None:
             bc = box.parent.backcolor
         else:
             bc = box.backcolor
         
-        self._canvas.setFillColorRGB(*self._translate_color(bc))
+        self._state.set_fill_color(bc)
         
         if box.color is None:
             fc = box.parent.color
         else:
             fc = box.color
             
-        self._canvas.setStrokeColorRGB(*self._translate_color(fc))
+        self._state.set_stroke_color(fc)
 
         self._canvas.roundRect(x, y - box.height * rl_mm, box.width * rl_mm, box.height * rl_mm, box.round, fill = 1)
+
+    def draw_picture(self, picture, environment = None):
+        """
+        Draws a picture. Each image is stored once in the document, and referenced by every picture showing it
+        """
+        
+        self._end_text()
+        
+        image = images.load_image(self.safe_eval(picture.value, environment))
+        
+        x, y = self._translate_coords(picture)
+        width = picture.width * rl_mm
+        height = picture.height * rl_mm
+        
+        c = self._canvas
+        
+        if self._streaming:
+            c.drawImage(image, x, y - height, width, height)
+            return
+        
+        name = self._image_forms.get(image.digest)
+        if name is None:
+            # A form of unit size, scaled on each use
+            name = "pic%s"%image.digest
+            c.beginForm(name, 0, 0, 1, 1)
+            c.drawImage(ImageReader(image.pil), 0, 0, 1, 1, mask = "auto")
+            c.endForm()
+            self._image_forms[image.digest] = name
         
-        self._canvas.restoreState()
\ No newline at end of file
+        c.saveState()
+        c.translate(x, y - height)
+        c.scale(width, height)
+        c.doForm(name)
+        c.restoreState()
@@ -0,0 +1,506 @@
+# Copyright(c) 2005-2007 Angelantonio Valente (y3sman@gmail.com)
+# See LICENSE file for details.
+
+"""
+Streaming PDF writer.
+
+Writes each PDF object to the output file as soon as it is complete, keeping
+in memory only the objects' offsets (for the cross-reference table) and the
+resources shared by all pages. It is used by the PDFRenderer (in streaming mode)
+and by the DirectPDFRenderer to produce very large documents in constant memory.
+"""
+
+import collections
+import zlib
+
+from multiprocessing.pool import ThreadPool
+
+from base import ReportError
+
+# The standard 14 fonts, that every PDF viewer must provide
+STANDARD_FONTS = (
+    "Courier", "Courier-Bold", "Courier-Oblique", "Courier-BoldOblique",
+    "Helvetica", "Helvetica-Bold", "Helvetica-Oblique", "Helvetica-BoldOblique",
+    "Times-Roman", "Times-Bold", "Times-Italic", "Times-BoldItalic",
+    "Symbol", "ZapfDingbats",
+)
+
+# zlib's default compression level
+DEFAULT_COMPRESS_LEVEL = 6
+
+# Bezier control point distance used to approximate a quarter of circle
+KAPPA = 0.5523
+
+def format_number(n):
+    """
+    Formats a number in the shortest way a PDF reader accepts
+    """
+    s = ("%.3f"%n).rstrip("0").rstrip(".")
+    if s in ("", "-0"):
+        return "0"
+    return s
+
+def escape_string(txt):
+    """
+    Encodes txt as a PDF literal string (including the parentheses), in the WinAnsiEncoding
+    of the standard fonts. Byte strings are taken as UTF-8; characters missing from the
+    encoding are replaced by "?"
+    """
+    if isinstance(txt, str):
+        txt = txt.decode("utf-8", "replace")
+    txt = txt.encode("cp1252", "replace")
+
+    txt = txt.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").replace("\r", "\\r")
+
+    return "(%s)"%txt
+
+class PDFWriter(object):
+    """
+    Low-level PDF file writer. Objects are written immediately and forgotten:
+    only their offsets are kept, to build the cross-reference table at the end.
+    @ivar out: The output file object
+    """
+
+    def __init__(self, out):
+        """
+        Constructor
+        @param out: A file object opened for binary writing
+        """
+
+        self.out = out
+
+        self.offsets = dict()
+        self.position = 0
+
+        self._next_object = 1
+
+        self._write("%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.out.write(data)
+        self.position += len(data)
+
+    def alloc(self):
+        """
+        Reserves a new object number. The object itself can be written later
+        @returns: The object number
+        """
+        num = self._next_object
+        self._next_object += 1
+        return num
+
+    def write_object(self, num, body):
+        """
+        Writes an object
+        @param num: The object number, as returned by alloc
+        @param body: The object's content, already in PDF syntax
+        """
+
+        if num in self.offsets:
+            raise ReportError("PDF object %s already written!"%num)
+
+        self.offsets[num] = self.position
+        self._write("%d 0 obj\n%s\nendobj\n"%(num, body))
+
+    def write_stream(self, num, data, entries = "", compress = True, level = DEFAULT_COMPRESS_LEVEL):
+        """
+        Writes a stream object
+        @param num: The object number, as returned by alloc
+        @param data: The stream's (uncompressed) data
+        @param entries: Additional entries of the stream's dictionary, in PDF syntax
+        @param compress: If True, the data will be Flate-compressed
+        @param level: The zlib compression level, from 1 (fastest) to 9 (smallest)
+        """
+
+        if compress:
+            data = zlib.compress(data, level)
+            entries += " /Filter /FlateDecode"
+
+        self.write_object(num, "<< /Length %d%s >>\nstream\n%s\nendstream"%(len(data), entries, data))
+
+    def close(self, root, info = None):
+        """
+        Writes the cross-reference table and the trailer. The output file is not closed.
+        @param root: The object number of the document catalog
+        @param info: The object number of the document information dictionary, if any
+        """
+
+        size = self._next_object
+
+        for num in range(1, size):
+            if num not in self.offsets:
+                raise ReportError("PDF object %s has never been written!"%num)
+
+        xref = self.position
+
+        lines = ["xref", "0 %d"%size, "0000000000 65535 f "]
+        for num in range(1, size):
+            lines.append("%010d 00000 n "%self.offsets[num])
+
+        trailer = "<< /Size %d /Root %d 0 R"%(size, root)
+        if info is not None:
+            trailer += " /Info %d 0 R"%info
+        trailer += " >>"
+
+        lines.extend(("trailer", trailer, "startxref", str(xref), "%%EOF", ""))
+
+        self._write("\n".join(lines))
+
+def rect_path(x, y, width, height, radius = 0):
+    """
+    Returns the path operators of a rectangle, with rounded corners if radius isn't 0
+    """
+
+    f = format_number
+
+    if not radius:
+        return "%s %s %s %s re"%(f(x), f(y), f(width), f(height))
+
+    r = min(radius, abs(width) / 2.0, abs(height) / 2.0)
+    k = r * KAPPA
+    x2 = x + width
+    y2 = y + height
+
+    path = [
+        "%s %s m"%(f(x + r), f(y)),
+        "%s %s l"%(f(x2 - r), f(y)),
+        "%s %s %s %s %s %s c"%(f(x2 - r + k), f(y), f(x2), f(y + r - k), f(x2), f(y + r)),
+        "%s %s l"%(f(x2), f(y2 - r)),
+        "%s %s %s %s %s %s c"%(f(x2), f(y2 - r + k), f(x2 - r + k), f(y2), f(x2 - r), f(y2)),
+        "%s %s l"%(f(x + r), f(y2)),
+        "%s %s %s %s %s %s c"%(f(x + r - k), f(y2), f(x), f(y2 - r + k), f(x), f(y2 - r)),
+        "%s %s l"%(f(x), f(y + r)),
+        "%s %s %s %s %s %s c"%(f(x), f(y + r - k), f(x + r - k), f(y), f(x + r), f(y)),
+        "h",
+    ]
+
+    return " ".join(path)
+
+def paint_operator(stroke, fill):
+    """
+    Returns the operator painting the current path
+    """
+    if stroke and fill:
+        return "B"
+    elif fill:
+        return "f"
+    elif stroke:
+        return "S"
+    return "n"
+
+class Document(object):
+    """
+    A PDF document written one page at a time. It keeps the page list and the font
+    resources (shared by all the pages) until the document is closed.
+    Page contents may be compressed by a pool of worker threads (zlib releases the
+    interpreter lock while compressing), while the next pages are being drawn. Pages are
+    written to the file in order anyway.
+    """
+
+    def __init__(self, out, compress = True, level = DEFAULT_COMPRESS_LEVEL, workers = 0):
+        """
+        Constructor
+        @param out: A file object opened for binary writing
+        @param compress: If True, page contents will be Flate-compressed
+        @param level: The zlib compression level, from 1 (fastest) to 9 (smallest)
+        @param workers: The number of compression threads. If 0, pages are compressed by the calling thread
+        """
+
+        self.writer = PDFWriter(out)
+        self.compress = compress
+        self.level = level
+
+        if compress and workers > 0:
+            self._pool = ThreadPool(workers)
+        else:
+            self._pool = None
+
+        # Pages waiting for their compressed contents: (page, contents, pagesize, result)
+        self._pending = collections.deque()
+        self._max_pending = 2 * workers
+
+        # Shared objects, written at the end
+        self._catalog = self.writer.alloc()
+        self._pages = self.writer.alloc()
+        self._resources = self.writer.alloc()
+
+        # Font resources, by face name: (resource name, object number)
+        self._fonts = dict()
+
+        # Image XObjects, by image digest: resource name
+        self._images = dict()
+        self._image_objects = list()
+
+        # Page object numbers
+        self._page_objects = list()
+
+    def font_resource(self, face):
+        """
+        Returns the resource name of a font face
+        @raise KeyError: if the face isn't a standard font
+        """
+        try:
+            return self._fonts[face][0]
+        except KeyError:
+            if face not in STANDARD_FONTS:
+                raise KeyError(face)
+
+            name = "F%d"%(len(self._fonts) + 1)
+            self._fonts[face] = (name, self.writer.alloc())
+            return name
+
+    def image_resource(self, image):
+        """
+        Returns the resource name of an image. Each image is written once, as an image XObject 
+        shared by all the pages
+        @param image: An images.Image object
+        """
+
+        try:
+            return self._images[image.digest]
+        except KeyError:
+            pass
+
+        writer = self.writer
+        rgb, alpha = image.get_flate()
+
+        entries = " /Type /XObject /Subtype /Image /Width %d /Height %d /BitsPerComponent 8"%(image.width, image.height)
+
+        smask = ""
+        if alpha is not None:
+            num = writer.alloc()
+            writer.write_stream(num, alpha, entries + " /ColorSpace /DeviceGray /Filter /FlateDecode", compress = False)
+            smask = " /SMask %d 0 R"%num
+
+        num = writer.alloc()
+        writer.write_stream(num, rgb, entries + " /ColorSpace /DeviceRGB /Filter /FlateDecode" + smask, compress = False)
+
+        name = "Im%d"%(len(self._images) + 1)
+        self._images[image.digest] = name
+        self._image_objects.append((name, num))
+
+        return name
+
+    @property
+    def page_count(self):
+        return len(self._page_objects)
+
+    def add_page(self, code, pagesize):
+        """
+        Writes a page
+        @param code: The page's content stream
+        @param pagesize: The page size in points
+        """
+
+        writer = self.writer
+
+        page = writer.alloc()
+        contents = writer.alloc()
+
+        self._page_objects.append(page)
+
+        if self._pool is None:
+            writer.write_stream(contents, code, compress = self.compress, level = self.level)
+            self._write_page(page, contents, pagesize)
+        else:
+            self._pending.append((page, contents, pagesize, self._pool.apply_async(zlib.compress, (code, self.level))))
+            self._write_pending()
+
+    def _write_page(self, page, contents, pagesize):
+        self.writer.write_object(page, "<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] /Resources %d 0 R /Contents %d 0 R >>"%(
+                                 self._pages, format_number(pagesize[0]), format_number(pagesize[1]), self._resources, contents))
+
+    def _write_pending(self, wait = False):
+        """
+        Writes the pages whose contents have been compressed, in order
+        @param wait: If True, waits until every page is written. Otherwise, waits only 
+                     while too many pages are pending
+        """
+
+        pending = self._pending
+        while pending:
+            page, contents, pagesize, result = pending[0]
+            if not (wait or len(pending) > self._max_pending or result.ready()):
+                break
+
+            pending.popleft()
+            self.writer.write_stream(contents, result.get(), " /Filter /FlateDecode", compress = False)
+            self._write_page(page, contents, pagesize)
+
+    def close(self):
+        """
+        Writes the shared resources, the page tree and the trailer. The output file is not closed.
+        """
+
+        if self._pool is not None:
+            try:
+                self._write_pending(True)
+            finally:
+                self._pool.terminate()
+
+        writer = self.writer
+
+        fonts = list()
+        for face, (name, num) in sorted(self._fonts.items(), key = lambda x: x[1][1]):
+            encoding = ""
+            if face not in ("Symbol", "ZapfDingbats"):
+                encoding = " /Encoding /WinAnsiEncoding"
+            writer.write_object(num, "<< /Type /Font /Subtype /Type1 /BaseFont /%s%s >>"%(face, encoding))
+            fonts.append("/%s %d 0 R"%(name, num))
+
+        images = " ".join("/%s %d 0 R"%x for x in self._image_objects)
+
+        writer.write_object(self._resources, "<< /ProcSet [/PDF /Text /ImageC] /Font << %s >> /XObject << %s >> >>"%(" ".join(fonts), images))
+
+        kids = " ".join("%d 0 R"%n for n in self._page_objects)
+        writer.write_object(self._pages, "<< /Type /Pages /Kids [%s] /Count %d >>"%(kids, len(self._page_objects)))
+
+        writer.write_object(self._catalog, "<< /Type /Catalog /Pages %d 0 R >>"%self._pages)
+
+        writer.close(self._catalog)
+
+    def abort(self):
+        """
+        Stops the compression threads, dropping the pending pages. Called instead of close
+        when the document can't be completed: the output file is left incomplete.
+        """
+
+        if self._pool is not None:
+            self._pool.terminate()
+
+        self._pending.clear()
+
+class ContentStream(object):
+    """
+    The operators of a page's content stream. It implements the subset of ReportLab's canvas
+    and text object API used by the PDFRenderer's GraphicsState and text batching: beginText
+    returns the stream itself, so a text object's operators are written in place, up to drawText.
+    """
+
+    def __init__(self, document):
+        """
+        Constructor
+        @param document: The Document holding the page's resources
+        """
+        self._document = document
+        self._code = list()
+
+    def setFont(self, face, size):
+        """
+        Sets the current font
+        @raise KeyError: if the face isn't a standard font
+        """
+        self._code.append("/%s %s Tf"%(self._document.font_resource(face), format_number(size)))
+
+    def setFillColorRGB(self, r, g, b):
+        self._code.append("%s %s %s rg"%tuple(format_number(x) for x in (r, g, b)))
+
+    def setStrokeColorRGB(self, r, g, b):
+        self._code.append("%s %s %s RG"%tuple(format_number(x) for x in (r, g, b)))
+
+    def setLineWidth(self, width):
+        self._code.append("%s w"%format_number(width))
+
+    def line(self, x1, y1, x2, y2):
+        self._code.append("%s %s m %s %s l S"%tuple(format_number(n) for n in (x1, y1, x2, y2)))
+
+    def rect(self, x, y, width, height, stroke = 1, fill = 0):
+        self._code.append("%s %s"%(rect_path(x, y, width, height), paint_operator(stroke, fill)))
+
+    def roundRect(self, x, y, width, height, radius, stroke = 1, fill = 0):
+        self._code.append("%s %s"%(rect_path(x, y, width, height, radius), paint_operator(stroke, fill)))
+
+    def drawImage(self, image, x, y, width, height):
+        """
+        Draws an image, scaled to width and height
+        @param image: An images.Image object
+        """
+        self._code.append("q %s 0 0 %s %s %s cm /%s Do Q"%(format_number(width), format_number(height), format_number(x), format_number(y),
+                                                         self._document.image_resource(image)))
+
+    def beginText(self):
+        self._code.append("BT")
+        return self
+
+    def moveCursor(self, dx, dy):
+        """
+        Moves the start of the next line by dx, dy. As in ReportLab, dy grows downwards
+        """
+        self._code.append("%s %s Td"%(format_number(dx), format_number(-dy)))
+
+    def textOut(self, txt):
+        self._code.append("%s Tj"%escape_string(txt))
+
+    def drawText(self, textobject):
+        self._code.append("ET")
+
+    def getCode(self):
+        return "\n".join(self._code)
+
+class Canvas(ContentStream):
+    """
+    A drawing surface that streams each page to the output file when the page is shown.
+    It implements the subset of ReportLab's canvas API used by the PDFRenderer in streaming
+    mode, so it can be used in its place. Only the standard 14 fonts are available.
+    """
+
+    def __init__(self, outfile, pagesize = (595.27, 841.89), compress = True, level = DEFAULT_COMPRESS_LEVEL, workers = 0):
+        """
+        Constructor
+        @param outfile: The output file name, or a file object opened for binary writing
+        @param pagesize: The page size in points
+        @param compress: If True, page contents will be Flate-compressed
+        @param level: The zlib compression level, from 1 (fastest) to 9 (smallest)
+        @param workers: The number of compression threads. Look at Document
+        """
+
+        if isinstance(outfile, basestring):
+            self._file = open(outfile, "wb")
+            self._own_file = True
+        else:
+            self._file = outfile
+            self._own_file = False
+
+        ContentStream.__init__(self, Document(self._file, compress, level, workers))
+
+        self._pagesize = pagesize
+
+    def setPageSize(self, size):
+        self._pagesize = size
+
+    def showPage(self):
+        """
+        Ends the current page and writes it to the output file
+        """
+
+        self._document.add_page(self.getCode(), self._pagesize)
+
+        self._code = list()
+
+    def getPageNumber(self):
+        return self._document.page_count + 1
+
+    def save(self):
+        """
+        Writes the shared resources, the page tree and the trailer, then closes the file (if we opened it)
+        """
+
+        if self._code:
+            self.showPage()
+
+        self._document.close()
+
+        if self._own_file:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    def abort(self):
+        """
+        Releases the document's resources without completing it, then closes the file (if we opened it)
+        """
+
+        self._document.abort()
+
+        if self._own_file:
+            self._file.close()
@@ -0,0 +1,181 @@
+# Copyright(c) 2005-2007 Angelantonio Valente (y3sman@gmail.com)
+# See LICENSE file for details.
+
+"""
+Prepared reports.
+
+A prepared report is a report template that is parsed, checked and compiled
+once, and then rendered any number of times with different parameters. It's
+meant for long-running processes (eg. a report server) rendering the same
+templates over and over.
+"""
+
+import Queue
+
+from base import *
+from parser import XMLParser
+from pdfrenderer import PDFRenderer
+import templatecache
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of dbapi2 connections
+    """
+
+    def __init__(self, module, conn_pars = None, size = 4):
+        """
+        Constructor
+        @param module: The dbapi2 module
+        @param conn_pars: Connection parameters, as a tuple of (args, kwargs). Look at DBDataProvider
+        @param size: The maximum number of idle connections kept in the pool
+        """
+
+        self.module = module
+        self.conn_pars = conn_pars
+
+        self._idle = Queue.Queue(size)
+
+    def get(self):
+        """
+        Returns an idle connection, or a new one if there isn't any
+        """
+
+        try:
+            return self._idle.get_nowait()
+        except Queue.Empty:
+            connargs = []
+            connkwargs = {}
+            if self.conn_pars:
+                connargs = self.conn_pars[0]
+                if len(self.conn_pars) > 1:
+                    connkwargs = self.conn_pars[1]
+
+            return self.module.connect(*connargs, **connkwargs)
+
+    def release(self, conn):
+        """
+        Gives back a connection obtained with get. If the pool is full, the connection is closed
+        """
+
+        try:
+            self._idle.put_nowait(conn)
+        except Queue.Full:
+            conn.close()
+
+class PreparedReport(object):
+    """
+    A report template ready to be rendered many times.
+    The template is parsed once, its expressions are compiled and the constant ones evaluated,
+    its fonts resolved. The report is never changed by a render (the run-time state lives in
+    a RenderContext), so render can be called by several threads at the same time.
+    @ivar report: The prepared Report object. Don't change it after preparation!
+    @ivar renderer: The renderer class used by default
+    @ivar pool: The connection pool used by the report's dbapi2 datasources, if any
+    """
+
+    def __init__(self, report = None, **kwargs):
+        """
+        Constructor
+        @param report: A Report object. If not given, the report is parsed from filename or xmlcontent
+        @keyword filename: The report definition file's name
+        @keyword xmlcontent: The report definition's XML code
+        @keyword cache_dir: A directory caching the parsed templates, shared by the processes 
+                            rendering them. Look at the templatecache module
+        @keyword renderer: The default renderer class (defaults to PDFRenderer)
+        @keyword module: The dbapi2 module used to connect to the database
+        @keyword conn_pars: The connection parameters, as a tuple of (args, kwargs)
+        @keyword pool_size: The maximum number of idle connections to keep (defaults to 4)
+        """
+
+        if report is None:
+            cache_dir = kwargs.get("cache_dir", None)
+            if cache_dir is not None:
+                report = templatecache.load_template(cache_dir, filename = kwargs.get("filename", None), 
+                                                     xmlcontent = kwargs.get("xmlcontent", None))
+            else:
+                report = XMLParser(**kwargs).parse()
+
+        self.report = report
+        self.renderer = kwargs.get("renderer", PDFRenderer)
+
+        module = kwargs.get("module", None)
+        if module is not None:
+            self.pool = ConnectionPool(module, kwargs.get("conn_pars", None), kwargs.get("pool_size", 4))
+        else:
+            self.pool = None
+
+        self._prepare()
+
+    def _sections(self):
+        r = self.report
+        return (r.title, r.header, r.body, r.footer, r.summary)
+
+    def _prepare(self):
+        """
+        Checks the report, compiles its expressions and resolves its fonts
+        """
+
+        self.report.check_sections_height()
+
+        renderer = self.renderer(self.report)
+
+        for section in self._sections():
+            for child in section.children:
+                if not isinstance(child, Text):
+                    continue
+
+                code, constant = compile_expression(child.value)
+                if constant:
+                    # The value is computed now and cached for every render
+                    renderer.safe_eval(child.value, None)
+
+                renderer.get_glyph_widths(child.font)
+
+        for calc in self.report.calculations:
+            compile_expression(calc.value)
+
+    def render(self, params = None, outfile = None, **kwargs):
+        """
+        Renders the report
+        @param params: A mapping of parameter names to values
+        @param outfile: The output file's name, or a file object. If not given, a temporary file will be created
+        @keyword renderer: The renderer class to use for this call
+        @keyword output: "bytes" or "memoryview": the rendered data is returned instead of being written to a file.
+                         "chunks": an iterator of data chunks is returned
+        @return: What the renderer's render method returns (usually the output file's path)
+        @raise ReportError: if a parameter isn't defined by the report
+        """
+
+        renderer = kwargs.pop("renderer", self.renderer)
+
+        if outfile is not None:
+            kwargs["outfile"] = outfile
+
+        conn = None
+        if self.pool is not None and "conn" not in kwargs:
+            conn = self.pool.get()
+            kwargs["conn"] = conn
+            kwargs["module"] = self.pool.module
+
+        try:
+            result = renderer(self.report).render(parameters = params, **kwargs)
+        except:
+            if conn is not None:
+                self.pool.release(conn)
+            raise
+        
+        if conn is not None:
+            if kwargs.get("output", None) == "chunks":
+                # The connection is used until the last chunk
+                return self._release_after(result, conn)
+            
+            self.pool.release(conn)
+            
+        return result
+    
+    def _release_after(self, chunks, conn):
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            self.pool.release(conn)
@@ -38,6 +38,7 @@ class Report(object):
     @ivar calculations: Aggregate calculation run by the engine using any available data (datasources, variables, parameters and so on). 
     @ivar datasources: List of report's datasources
     @ivar fonts: Report fonts
+    @ivar font_files: TrueType font files, by face name
     """
     
     def __init__(self, page = Page('A4')):
@@ -82,6 +83,9 @@ class Report(object):
         
         # Fonts
         self.fonts = dict()
+        
+        # TrueType font files, by face name
+        self.font_files = dict()
     
     def check_sections_height(self):
         """
@@ -128,14 +132,20 @@ class Report(object):
         calc.report = self
         self.calculations.append(calc)
     
-    def register_font(self, font):
+    def register_font(self, font, filename = None):
         """
         Registers a new font for this report
         @param font: The font object
         @type font: Font
+        @param filename: A TrueType font file. If given, the font's face is loaded from this file.
+                         A TrueType file is a face on its own: bold and italic variants must be
+                         registered as different faces
         """
         self.fonts[font.id] = font
         
+        if filename is not None:
+            self.font_files[font.face] = filename
+        
     def get_font(self, name):
         """
         Gets the font named "name" in this report, if exists
@@ -156,45 +166,89 @@ class Report(object):
     
     size = property(get_size, None, None, """ Report's size is page's size! """)
 
-    def _draw_new_page(self, renderer, environment):
-        renderer.start_page()
+    def _draw_new_page(self, renderer, environment, draw = True):
+        context = environment.context
+        
+        if draw:
+            renderer.start_page()
         
         # If this is the first page, draw the title band (only once per report)
-        if self.pagenum == 0:
+        if context.pagenum == 0:
             y = self.title.y
-            self.title.draw(renderer, environment)
+            if draw:
+                self.title.draw(renderer, environment)
             y += self.title.height
         else:
             y = 0
 
-        self.header.y = y
+        context.set_y(self.header, y)
         
-        self.pagenum += 1
-        self.header.draw(renderer, environment)
+        context.pagenum += 1
+        if draw:
+            self.header.draw(renderer, environment)
         y += self.header.height
 
-        self.body.y = y
+        context.set_y(self.body, y)
         
         return y
 
-    def _draw_footer(self, renderer, environment):
-        self.footer.y = self.page.height - self.footer.height
+    def _draw_footer(self, renderer, environment, draw = True):
+        if not draw:
+            return
+        
+        environment.context.set_y(self.footer, self.page.height - self.footer.height)
         self.footer.draw(renderer, environment)
         renderer.finalize_page()
 
-    def process(self, renderer):
+    def _in_range(self, pagenum, pages):
+        """
+        Returns True if the page pagenum should be drawn
+        """
+        if pages is None:
+            return True
+        
+        return pages[0] <= pagenum <= pages[1]
+
+    def process(self, renderer, context = None, dry_run = False):
         """
         Starts processing the report.
+        The report itself isn't changed while processing, so it can be processed by several renderers at once.
+        If the renderer has a "pages" attribute, as a (first, last) tuple, only that range of pages is drawn: 
+        the preceding records are skipped evaluating only the calculations not reset at each page.
         @param renderer: The Renderer object to draw to
+        @param context: The RenderContext to use. If not given, a new one is created 
+                        with the renderer's parameters
+        @param dry_run: If True, nothing is drawn and no calculation is executed: only the pagination is computed. 
+                        Stretchable body's children are still evaluated, to know the body's height
+        @returns: The RenderContext of the run
+        """
+        
+        if context is None:
+            context = RenderContext(self, getattr(renderer, "parameters", None))
+        
+        for pagenum in self.iter_process(renderer, context, dry_run):
+            pass
+        
+        return context
+    
+    def iter_process(self, renderer, context = None, dry_run = False):
+        """
+        Processes the report one page at a time: a generator yielding each page's number 
+        as soon as the page is finalized by the renderer. Look at process for the parameters
         """
 
         self.check_sections_height()
 
-        self.pagenum = 0
-        reset_calcs = False
-        self.currentrow = None
+        if context is None:
+            context = RenderContext(self, getattr(renderer, "parameters", None))
+        
+        renderer.context = context
         
-        environment = Data(self)
+        pages = getattr(renderer, "pages", None)
+        if dry_run:
+            pages = (0, -1)
+        
+        environment = Data(self, context)
 
         # Flag to know if we should create a new page
         newpage = True
@@ -209,29 +263,73 @@ class Report(object):
         # the footer twice when the last record consumes exactly all the space)
         footer_drawn = False
         
+        # Flag to indicate that we stopped before the datasource's end, because the requested pages are done
+        stopped = False
+        
         # Cycle through the datasource
         datasource = iter(renderer.maindatasource)
         
         while(True):
             if not block_iter:
                 try:
-                    self.currentrow = datasource.next()
+                    context.currentrow = datasource.next()
                     rec_number += 1
                 except StopIteration:
                     break
 
             if newpage:
-                y = self._draw_new_page(renderer, environment)
+                if not dry_run and pages is not None and context.pagenum >= pages[1]:
+                    # The requested pages are all drawn
+                    stopped = True
+                    break
+                
+                draw = self._in_range(context.pagenum + 1, pages)
+                
+                # Reset page-resetted calcs
+                for calc in self.calculations:
+                    if calc.reset_at == "page":
+                        calc.reset(context)
+                
+                y = self._draw_new_page(renderer, environment, draw)
+                context.page_records.append([rec_number, rec_number])
                 
                 block_iter = False
                 newpage = False
                 footer_drawn = False
+                page_rows = 0
 
+            if self.body.stretchable:
+                # Stretched texts may show the variables: they are measured once the row's 
+                # calculations are executed. The calculations are undone if the row doesn't fit.
+                # Every calculation is executed, so the pagination is the same on every page range
+                saved = context.save_calcs()
+                for calc in self.calculations:
+                    calc.execute(renderer, environment)
+                
+                # Body's height, once its stretchable children have grown to fit the current row
+                body_height = self.body.get_stretched_height(renderer, environment)
+            else:
+                saved = None
+                body_height = self.body.height
+            
             # If y position exceeds body's reserved space, draws the footer
             # and starts a new page
-            if (y + self.body.height) > self.page.height - self.footer.height:
+            if (y + body_height) > self.page.height - self.footer.height:
+                if body_height > self.page.height - self.header.height - self.footer.height:
+                    # It wouldn't fit on a new page either
+                    raise ReportError("Body band too high for the page (row %s, height: %s)!"%(rec_number, body_height))
+                
+                if saved is not None:
+                    context.restore_calcs(saved)
+                
+                if not page_rows:
+                    # The title left too little room: the page has no records
+                    context.page_records[-1] = None
+                
                 # Draws footer
-                self._draw_footer(renderer, environment)
+                self._draw_footer(renderer, environment, draw)
+                if draw:
+                    yield context.pagenum
                 
                 newpage = True
                 block_iter = True
@@ -239,36 +337,50 @@ class Report(object):
                 
                 continue
 
-            # Execute report's calculations
-            for calc in self.calculations:
-                calc.execute(renderer, environment)
+            # Execute report's calculations. On skipped pages only the ones lasting 
+            # until the report's end matter
+            if saved is None and not dry_run:
+                for calc in self.calculations:
+                    if draw or calc.reset_at == "end":
+                        calc.execute(renderer, environment)
                 
             # Draws body band
-            self.body.draw(renderer, environment)
-            y += self.body.height
-            self.body.y = y
-
-            if reset_calcs:
-                reset_calcs = False
-                # Reset page-resetted calcs
-                for calc in self.calculations:
-                    if calc.reset_at == "page":
-                        calc.reset()
+            if draw:
+                self.body.draw(renderer, environment)
+            y += body_height
+            context.set_y(self.body, y)
+            page_rows += 1
+            
+            context.page_records[-1][1] = rec_number
 
         if not rec_number:
             raise ReportError("No data available!")
 
         # Draws summary band
-        if self.summary.height < self.page.height - self.footer.height - y:
-            self.summary.y = y
-            self.summary.draw(renderer, environment)
+        if stopped:
+            pass
+        elif self.summary.height < self.page.height - self.footer.height - y:
+            context.set_y(self.summary, y)
+            if draw:
+                self.summary.draw(renderer, environment)
             if not footer_drawn:
-                self._draw_footer(renderer, environment)
+                self._draw_footer(renderer, environment, draw)
+                if draw:
+                    yield context.pagenum
         else:
             if not footer_drawn:
-                self._draw_footer(renderer, environment)
+                self._draw_footer(renderer, environment, draw)
+                if draw:
+                    yield context.pagenum
             # New page
-            y = self._draw_new_page(renderer, environment)
-            self.summary.y = y
-            self.summary.draw(renderer, environment)
-            self._draw_footer(renderer, environment)
+            draw = self._in_range(context.pagenum + 1, pages)
+            y = self._draw_new_page(renderer, environment, draw)
+            context.page_records.append(None)
+            context.set_y(self.summary, y)
+            if draw:
+                self.summary.draw(renderer, environment)
+            self._draw_footer(renderer, environment, draw)
+            if draw:
+                yield context.pagenum
+        
+        context.page_records = [r and tuple(r) for r in context.page_records]
@@ -0,0 +1,294 @@
+# Copyright(c) 2005-2007 Angelantonio Valente (y3sman@gmail.com)
+# See LICENSE file for details.
+
+"""
+SVG renderer
+Renders each page of a report to its own SVG document: cheap previews and thumbnails for web viewers.
+"""
+
+import cgi
+import collections
+import multiprocessing
+import os
+import tempfile
+
+from base import *
+import textlayout
+import images
+
+# Name of a page file
+PAGE_FILE = "page-%d.svg"
+
+# Text baseline, below the top of a line, as a fraction of the font size
+ASCENT = 0.8
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1" width="%(width)smm" height="%(height)smm" viewBox="0 0 %(width)s %(height)s">
+"""
+
+def serialize_page(size, elements):
+    """
+    Returns the SVG document of a page
+    @param size: The page size, as a (width, height) tuple in millimeters
+    @param elements: The page's elements, as recorded by SVGRenderer
+    """
+
+    code = [HEADER%dict(width = size[0], height = size[1])]
+
+    for element in elements:
+        kind = element[0]
+
+        if kind == "text":
+            x, y, anchor, color, family, size, weight, lines = element[1:]
+
+            leading = textlayout.LEADING * size
+
+            code.append("""<text x="%.2f" y="%.2f" text-anchor="%s" fill="%s" font-family="%s" font-size="%.2f"%s>"""%(
+                        x, y + ASCENT * size, anchor, color, family, size, weight))
+            if len(lines) == 1:
+                code.append(cgi.escape(lines[0]))
+            else:
+                for i, line in enumerate(lines):
+                    code.append("""<tspan x="%.2f" y="%.2f">%s</tspan>"""%(x, y + ASCENT * size + i * leading, cgi.escape(line)))
+            code.append("</text>\n")
+        elif kind == "line":
+            code.append("""<line x1="%.2f" y1="%.2f" x2="%.2f" y2="%.2f" stroke="%s" stroke-width="%.2f"/>\n"""%element[1:])
+        elif kind == "rect":
+            code.append("""<rect x="%.2f" y="%.2f" width="%.2f" height="%.2f" rx="%.2f" fill="%s" stroke="%s" stroke-width="%.2f"/>\n"""%element[1:])
+        elif kind == "image":
+            code.append("""<image x="%.2f" y="%.2f" width="%.2f" height="%.2f" preserveAspectRatio="none" xlink:href="%s"/>\n"""%element[1:])
+
+    code.append("</svg>\n")
+
+    return "".join(code)
+
+def write_page(path, size, elements):
+    """
+    Writes the SVG document of a page to a file
+    @param path: The file's path
+    @returns: The file's path
+    """
+
+    f = open(path, "wb")
+    try:
+        f.write(serialize_page(size, elements))
+    finally:
+        f.close()
+
+    return path
+
+class SVGRenderer(Renderer):
+    """
+    Renders a report to SVG documents, one per page. While drawing, the renderer only records
+    each page's elements: finished pages are serialized and written by a pool of worker processes,
+    while the next ones are laid out.
+    """
+
+    def render(self, *args, **kwargs):
+        """
+        Make a SVG file for each page
+        @keyword outdir: The directory of the page files (page-1.svg, page-2.svg, ...). If not given
+                         a temporary directory will be created. The page files of a previous render are removed
+        @keyword output: "bytes": the SVG documents are returned instead of being written to files
+        @keyword workers: The number of processes serializing and writing the pages. If 0 (the default),
+                          pages are written by the rendering process. The processes are started by the render,
+                          and stopped when it ends
+        @keyword pool: A multiprocessing.Pool serializing and writing the pages, to share the worker processes
+                       between renders. It's owned by the caller, and left running
+        @return: The list of the page files' paths, or of the SVG documents (look at the output keyword)
+        """
+        super(SVGRenderer, self).render(*args, **kwargs)
+
+        output = kwargs.get("output", None)
+        if output not in (None, "bytes"):
+            raise ReportError("Invalid SVG output: %s"%output)
+
+        if output is None:
+            self._outdir = kwargs.get("outdir", None)
+            if self._outdir is None:
+                self._outdir = tempfile.mkdtemp("", "REP_")
+            elif not os.path.isdir(self._outdir):
+                try:
+                    os.makedirs(self._outdir)
+                except OSError, e:
+                    raise ReportError("Unable to create the output directory <%s>.\n%s"%(self._outdir, e))
+
+            for name in os.listdir(self._outdir):
+                if name.startswith("page-") and name.endswith(".svg"):
+                    os.remove(os.path.join(self._outdir, name))
+        else:
+            self._outdir = None
+
+        self._size = (self.report.page.width, self.report.page.height)
+        self._results = list()
+
+        workers = kwargs.get("workers", 0)
+
+        self._pool = kwargs.get("pool", None)
+        own_pool = self._pool is None and workers > 0
+        if own_pool:
+            self._pool = multiprocessing.Pool(workers)
+
+        self._pending = collections.deque()
+        self._max_pending = 2 * (workers or multiprocessing.cpu_count())
+
+        try:
+            self.report.process(self)
+            self._collect_pending(True)
+        except:
+            # The pages still pending are dropped
+            self._pending.clear()
+            if own_pool:
+                self._pool.terminate()
+                self._pool.join()
+            raise
+
+        if own_pool:
+            self._pool.close()
+            self._pool.join()
+
+        return self._results
+
+    def _collect_pending(self, wait = False):
+        """
+        Collects the results of the pages handed to the workers, in order
+        @param wait: If True, waits until every page is done. Otherwise, waits only
+                     while too many pages are pending
+        """
+
+        pending = self._pending
+        while pending:
+            result = pending[0]
+            if not (wait or len(pending) > self._max_pending or result.ready()):
+                break
+
+            pending.popleft()
+            self._results.append(result.get())
+
+    def start_page(self):
+        """
+        Called on new page's begin
+        """
+        self._elements = list()
+
+    def finalize_page(self):
+        """
+        Called on page end: the page's elements are serialized
+        """
+        super(SVGRenderer, self).finalize_page()
+
+        if self._outdir is None:
+            func, args = serialize_page, (self._size, self._elements)
+        else:
+            path = os.path.join(self._outdir, PAGE_FILE%(len(self._results) + len(self._pending) + 1))
+            func, args = write_page, (path, self._size, self._elements)
+
+        self._elements = None
+
+        if self._pool is None:
+            self._results.append(func(*args))
+        else:
+            self._pending.append(self._pool.apply_async(func, args))
+            self._collect_pending()
+
+    def _translate_coords(self, obj):
+        """
+        Returns the absolute coordinates of an object's top left corner
+        """
+        return (obj.x + obj.parent.x, self.context.get_y(obj.parent) + obj.y)
+
+    def draw_text(self, text, environment = None):
+        """
+        Draws a text object
+        """
+
+        x, y = self._translate_coords(text)
+
+        if text.stretch:
+            lines = self.wrap_text(text, environment)
+        else:
+            lines = [str(self.safe_eval(text.value, environment))]
+
+        if text.alignment == Text.ALIGN_CENTER:
+            x += text.width / 2.0
+            anchor = "middle"
+        elif text.alignment == Text.ALIGN_RIGHT:
+            x += text.width
+            anchor = "end"
+        else:
+            anchor = "start"
+
+        fc = text.color
+        if fc is None:
+            fc = text.parent.color
+
+        font = text.font
+
+        weight = ""
+        if Font.BOLD in font.style:
+            weight += ' font-weight="bold"'
+        if Font.ITALIC in font.style:
+            weight += ' font-style="italic"'
+
+        self._elements.append(("text", x, y, anchor, fc.to_hex(), ", ".join(font.faces), font.size / textlayout.PT_PER_MM,
+                               weight, lines))
+
+    def draw_hline(self, shape, environment = None):
+        """
+        Draws an horizontal line
+        """
+
+        x, y = self._translate_coords(shape)
+
+        fc = shape.color
+        if fc is None:
+            fc = shape.parent.color
+
+        self._elements.append(("line", x, y, x + shape.width, y, fc.to_hex(), shape.linewidth))
+
+    def draw_vline(self, shape, environment = None):
+        """
+        Draws a vertical line
+        """
+
+        x, y = self._translate_coords(shape)
+
+        fc = shape.color
+        if fc is None:
+            fc = shape.parent.color
+
+        self._elements.append(("line", x, y, x, y + shape.height, fc.to_hex(), shape.linewidth))
+
+    def draw_box(self, box, environment = None):
+        """
+        Draws a box (may have rounded corners)
+        """
+
+        x, y = self._translate_coords(box)
+
+        bc = box.backcolor
+        if bc is None:
+            bc = box.parent.backcolor
+
+        fc = box.color
+        if fc is None:
+            fc = box.parent.color
+
+        # The corners' radius is given in points
+        self._elements.append(("rect", x, y, box.width, box.height, box.round / textlayout.PT_PER_MM, bc.to_hex(), fc.to_hex(),
+                               box.linewidth))
+
+    def draw_picture(self, picture, environment = None):
+        """
+        Draws a picture. Image files are referenced by name, other images are embedded as data URIs
+        """
+
+        x, y = self._translate_coords(picture)
+
+        source = self.safe_eval(picture.value, environment)
+        if images.is_file_name(source):
+            href = cgi.escape(source, True)
+        else:
+            href = images.load_image(source).get_data_uri()
+
+        self._elements.append(("image", x, y, picture.width, picture.height, href))
@@ -0,0 +1,141 @@
+# Copyright(c) 2005-2007 Angelantonio Valente (y3sman@gmail.com)
+# See LICENSE file for details.
+
+"""
+Tabular renderer
+Exports the body data of a report as a table, to a CSV or XLSX file.
+Writing XLSX files needs the XlsxWriter package.
+"""
+
+import csv
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+from base import *
+
+class TabularRenderer(Renderer):
+    """
+    Exports the report's body data: one row per datasource record, and one column per Text
+    of the body band, ordered by x position. There's no page layout: the title, header,
+    footer and summary bands aren't evaluated, and the other body objects are ignored.
+    Calculations are still executed on each record (they are never reset by pages),
+    so the columns can show running values.
+    """
+
+    def render(self, *args, **kwargs):
+        """
+        Export the body data
+        @keyword outfile: Output file name or file object, if not given a temporary file will be created
+        @keyword output: "bytes" or "memoryview": the data is returned instead of being written to a file
+        @keyword format: "csv" (the default) or "xlsx"
+        @keyword header: A list of column titles, written as the first row
+        @keyword dialect: The csv module's dialect of CSV files (defaults to "excel")
+        @keyword sheet: The worksheet's name of XLSX files
+        @return: The path of the new file, the given file object, or the data (look at the output keyword)
+        """
+        super(TabularRenderer, self).render(*args, **kwargs)
+
+        format = kwargs.get("format", "csv")
+        if format not in ("csv", "xlsx"):
+            raise ReportError("Invalid tabular format: %s"%format)
+
+        if format == "xlsx" and xlsxwriter is None:
+            raise ReportError("The XlsxWriter package is needed to write XLSX files")
+
+        if kwargs.get("output", None) == "chunks":
+            raise ReportError("Tabular output can't be chunked!")
+
+        out, outfile = self.open_output("." + format, **kwargs)
+
+        if format == "csv":
+            self._write_csv(out, kwargs)
+        else:
+            self._write_xlsx(out, kwargs)
+
+        return self.close_output(out, outfile, **kwargs)
+
+    def get_columns(self):
+        """
+        Returns the body's texts, ordered by x (then y) position
+        """
+
+        texts = [child for child in self.report.body.children if isinstance(child, Text)]
+        texts.sort(key = lambda x: (x.x, x.y))
+
+        return texts
+
+    def iter_rows(self):
+        """
+        Evaluates the columns on each datasource record
+        @returns: An iterator of rows, as lists of values
+        """
+
+        context = RenderContext(self.report, getattr(self, "parameters", None))
+        self.context = context
+        environment = Data(self.report, context)
+
+        codes = [compile_expression(text.value)[0] for text in self.get_columns()]
+        calculations = self.report.calculations
+
+        glo = dict(__builtins__ = dict(__import__ = __import__))
+        loc = environment.get_data()
+
+        rec_number = 0
+
+        for row in self.maindatasource:
+            context.currentrow = row
+            rec_number += 1
+
+            if calculations:
+                # Variables may change on each record
+                for calc in calculations:
+                    calc.execute(self, environment)
+                loc = environment.get_data()
+            else:
+                loc["row"] = row
+
+            try:
+                values = [eval(code, glo, loc) for code in codes]
+            except StandardError, e:
+                raise ReportError("%s (row %s)"%(e, rec_number))
+
+            yield values
+
+        if not rec_number:
+            raise ReportError("No data available!")
+
+    def _write_csv(self, out, options):
+        writer = csv.writer(out, options.get("dialect", "excel"))
+
+        header = options.get("header", None)
+        if header:
+            writer.writerow([self._encode(x) for x in header])
+
+        encode = self._encode
+        writer.writerows([encode(x) for x in values] for values in self.iter_rows())
+
+    def _encode(self, value):
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+        return value
+
+    def _write_xlsx(self, out, options):
+        # Rows are written to disk as they come, instead of being kept in memory
+        workbook = xlsxwriter.Workbook(out, dict(constant_memory = True))
+        worksheet = workbook.add_worksheet(options.get("sheet", None))
+
+        r = 0
+
+        header = options.get("header", None)
+        if header:
+            worksheet.write_row(r, 0, header)
+            r += 1
+
+        for values in self.iter_rows():
+            worksheet.write_row(r, 0, values)
+            r += 1
+
+        workbook.close()
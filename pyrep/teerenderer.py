@@ -0,0 +1,154 @@
+# Copyright(c) 2005-2007 Angelantonio Valente (y3sman@gmail.com)
+# See LICENSE file for details.
+
+"""
+Tee renderer
+Renders a report to several formats at once, with a single pass over the data.
+"""
+
+import os
+
+from base import *
+import images
+
+class TeeRenderer(Renderer):
+    """
+    Forwards the drawing of a report to several target renderers. The datasources are run,
+    the calculations executed and the expressions evaluated once: the targets get the
+    evaluated values. The targets must be able to begin and end their document apart from
+    processing the report, as PDFRenderer, DirectPDFRenderer and HTMLRenderer do.
+    Stretching texts are measured with the first target's glyph widths only, so the pagination
+    is the one it would compute on its own: the other targets break the lines with their own
+    widths, and a stretched text may take a little more or less room there.
+    """
+
+    # The output keywords a target may be given: the others (eg. show, or HTML's paged) are
+    # handled by the renderers' render methods, which the tee doesn't call
+    target_options = ("outfile", "output", "compress", "compress_level", "compress_workers",
+                      "streaming", "buffer_size", "gzip")
+
+    def render(self, *args, **kwargs):
+        """
+        Make an output file for each target
+        @keyword targets: A list of (renderer class, options) tuples. The options are the output keywords
+                          of the renderer's render method listed in target_options (eg. outfile, output,
+                          compress...), except chunked output
+        @return: The list of the targets' results, as returned by their render methods
+        @raise ReportError: if there isn't any target, or a target is given an unsupported option
+        """
+        super(TeeRenderer, self).render(*args, **kwargs)
+
+        targets = kwargs.get("targets", None)
+        if not targets:
+            raise ReportError("No target renderers!")
+
+        self._targets = list()
+        outputs = list()
+
+        try:
+            for cls, options in targets:
+                if options.get("output", None) == "chunks":
+                    raise ReportError("Target renderers can't produce chunked output!")
+
+                for name in options:
+                    if name not in self.target_options:
+                        raise ReportError("Unsupported target option: %s"%name)
+
+                target = cls(self.report)
+                target.parameters = self.parameters
+                target.pages = self.pages
+
+                out, outfile = target.open_output(target.suffix, **options)
+                outputs.append((out, outfile, options))
+
+                target._begin_document(out, options)
+                self._targets.append(target)
+
+            # The targets share the run's state
+            context = RenderContext(self.report, self.parameters)
+            for target in self._targets:
+                target.context = context
+
+            self.report.process(self, context)
+        except:
+            # The documents already begun are released, and the files opened here removed
+            for target in self._targets:
+                target._abort_document()
+            for out, outfile, options in outputs:
+                if outfile is not None:
+                    out.close()
+                    os.remove(outfile)
+            raise
+
+        results = list()
+        for target, (out, outfile, options) in zip(self._targets, outputs):
+            target._end_document()
+            results.append(target.close_output(out, outfile, **options))
+
+        return results
+
+    def get_glyph_widths(self, font):
+        """
+        Returns the glyph width table of the first target
+        """
+        return self._targets[0].get_glyph_widths(font)
+
+    def start_page(self):
+        """
+        Called on new page's begin
+        """
+        for target in self._targets:
+            target.start_page()
+
+    def finalize_page(self):
+        """
+        Called on page end
+        """
+        for target in self._targets:
+            target.finalize_page()
+
+    def draw_text(self, text, environment = None):
+        """
+        Draws a text object
+        """
+
+        value = Evaluated(str(self.safe_eval(text.value, environment)))
+
+        for target in self._targets:
+            target.draw_text(text, value)
+
+    def draw_hline(self, shape, environment = None):
+        """
+        Draws an horizontal line
+        """
+        for target in self._targets:
+            target.draw_hline(shape, environment)
+
+    def draw_vline(self, shape, environment = None):
+        """
+        Draws a vertical line
+        """
+        for target in self._targets:
+            target.draw_vline(shape, environment)
+
+    def draw_box(self, box, environment = None):
+        """
+        Draws a box (may have rounded corners)
+        """
+        for target in self._targets:
+            target.draw_box(box, environment)
+
+    def draw_picture(self, picture, environment = None):
+        """
+        Draws a picture. Sources other than file names (eg. file-like objects) can be read
+        only once: the image is loaded here, and the targets get the decoded image
+        """
+
+        source = self.safe_eval(picture.value, environment)
+        if not images.is_file_name(source):
+            source = images.load_image(source)
+
+        value = Evaluated(source)
+
+        for target in self._targets:
+            target.draw_picture(picture, value)
@@ -0,0 +1,188 @@
+# Copyright(c) 2005-2007 Angelantonio Valente (y3sman@gmail.com)
+# See LICENSE file for details.
+
+"""
+Template cache.
+
+Parsed report templates are kept on disk, so the processes rendering the same templates
+don't parse them again. An entry is keyed by the hash of the template's content, of
+PyRep's sources and of the Python bytecode version: any change (eg. an upgrade changing
+the pickled classes) gives a new key, so old entries are simply never read again.
+An entry that can't be loaded is ignored, and the template is parsed (and the entry
+written) again.
+
+Entries are pickles: loading one runs any code it contains. The cache directory must
+be trusted, writable only by the users running the reports.
+"""
+
+import cPickle
+import glob
+import hashlib
+import imp
+import logging
+import marshal
+import os
+import tempfile
+
+import base
+from base import *
+from report import Report
+from parser import XMLParser
+
+# Cache file names' suffix
+CACHE_SUFFIX = ".pyrep"
+
+# Digest of PyRep's sources, computed on first use
+_fingerprint = None
+
+def _get_fingerprint():
+    """
+    Returns the SHA-1 hex digest of PyRep's module sources (or compiled modules, if the
+    sources aren't installed)
+    """
+
+    global _fingerprint
+
+    if _fingerprint is None:
+        package = os.path.dirname(os.path.abspath(__file__))
+        paths = glob.glob(os.path.join(package, "*.py")) or glob.glob(os.path.join(package, "*.py[co]"))
+
+        h = hashlib.sha1(VERSION)
+        for path in sorted(paths):
+            f = open(path, "rb")
+            try:
+                h.update(f.read())
+            finally:
+                f.close()
+
+        _fingerprint = h.hexdigest()
+
+    return _fingerprint
+
+def cache_key(content, filename = None):
+    """
+    Returns the cache key of a template
+    @param content: The template's XML code
+    @param filename: The template file's name. Font files are looked for relatively to it,
+                     so the same content in another directory is a different template
+    """
+
+    h = hashlib.sha1()
+    h.update(_get_fingerprint())
+    h.update(imp.get_magic())
+
+    if filename is not None:
+        h.update(os.path.dirname(os.path.abspath(filename)))
+
+    h.update("\0")
+    h.update(content)
+
+    return h.hexdigest()
+
+def _expressions(report):
+    """
+    Returns the compiled expressions of the report, by source
+    """
+
+    sources = [child.value for section in (report.title, report.header, report.body, report.footer, report.summary)
+               for child in section.children if isinstance(child, Text)]
+    sources.extend(calc.value for calc in report.calculations)
+
+    compiled = dict()
+    for source in sources:
+        try:
+            compiled[source] = compile_expression(source)
+        except ReportError:
+            # Reported when the report is rendered
+            pass
+
+    return compiled
+
+def _load(path):
+    f = open(path, "rb")
+    try:
+        report = cPickle.load(f)
+        compiled = marshal.load(f)
+    finally:
+        f.close()
+
+    if not isinstance(report, Report) or not isinstance(compiled, dict):
+        raise ValueError("Invalid cache entry")
+
+    for source, value in compiled.items():
+        base._compiled.setdefault(source, value)
+
+    return report
+
+def _store(path, report):
+    # Written to a temporary file first: a reader never sees a partial entry
+    fd, tmp = tempfile.mkstemp(CACHE_SUFFIX, "tmp", os.path.dirname(path))
+    try:
+        f = os.fdopen(fd, "wb")
+        try:
+            cPickle.dump(report, f, cPickle.HIGHEST_PROTOCOL)
+            marshal.dump(_expressions(report), f)
+        finally:
+            f.close()
+
+        if os.name == "nt" and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+def load_template(cache_dir, **kwargs):
+    """
+    Returns the parsed report of a template, from the cache if possible
+    @param cache_dir: The cache directory, created if missing. Its entries are unpickled,
+                      so it must be a trusted directory (look at the module's documentation)
+    @keyword filename: The report definition file's name
+    @keyword xmlcontent: The report definition's XML code
+    @returns: A Report object
+    @raise ReportError: if the template can't be read or parsed
+    """
+
+    filename = kwargs.get("filename", None)
+
+    if filename:
+        try:
+            f = open(filename, "rb")
+            try:
+                content = f.read()
+            finally:
+                f.close()
+        except IOError, e:
+            raise ReportError("Parsing error:\nUnable to open report file <%s>.\n%s"%(filename, e))
+    else:
+        filename = None
+        content = kwargs.get("xmlcontent", None)
+        if content is None:
+            raise ReportError("Please pass a file name or an xml content to parse!")
+
+    if isinstance(content, unicode):
+        key = cache_key(content.encode("utf-8"), filename)
+    else:
+        key = cache_key(content, filename)
+
+    path = os.path.join(cache_dir, key + CACHE_SUFFIX)
+
+    if os.path.exists(path):
+        try:
+            return _load(path)
+        except Exception, e:
+            logging.warn("Invalid template cache entry <%s>: %s"%(path, e))
+
+    # The content already read is parsed: the entry must hold the parse of the keyed content,
+    # even if the file changes meanwhile
+    report = XMLParser(filename = filename, xmlcontent = content).parse()
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        _store(path, report)
+    except Exception, e:
+        # Not cached: the next load will parse the template again
+        logging.warn("Unable to write template cache entry <%s>: %s"%(path, e))
+
+    return report
@@ -0,0 +1,239 @@
+# Copyright(c) 2005-2007 Angelantonio Valente (y3sman@gmail.com)
+# See LICENSE file for details.
+
+"""
+Text layout helpers.
+
+Glyph width tables, line breaking and text fitting, shared by the renderers. Widths are
+kept in 1/1000 of the font size (the usual font metrics unit), so one table
+serves every size of the same face.
+Texts are measured by character: byte strings are taken as UTF-8.
+"""
+
+import bisect
+import collections
+
+# Average glyph width used when no real metrics are available
+AVERAGE_WIDTH = 500
+
+# Line spacing, as a fraction of the font size
+LEADING = 1.2
+
+# Points per millimeter
+PT_PER_MM = 72 / 25.4
+
+# Appended to the strings cut by fit_text in ellipsis mode
+ELLIPSIS = "..."
+
+# Maximum number of fitted strings kept in cache
+FIT_CACHE_SIZE = 10000
+
+def decode(txt):
+    """
+    Returns txt as a unicode string. Byte strings are decoded from UTF-8, invalid bytes
+    being replaced
+    """
+    if isinstance(txt, str):
+        return txt.decode("utf-8", "replace")
+    return txt
+
+class GlyphWidths(object):
+    """
+    Glyph advance widths of a font face, filled lazily one glyph at a time.
+    @ivar face: The font face's name
+    """
+
+    def __init__(self, face, measure = None):
+        """
+        Constructor
+        @param face: The font face's name
+        @param measure: A callable returning the width of a single character in 1/1000 of
+                        the font size. If None, AVERAGE_WIDTH is used for each glyph
+        """
+
+        self.face = face
+        self._measure = measure
+        self._widths = dict()
+
+    def __getitem__(self, char):
+        try:
+            return self._widths[char]
+        except KeyError:
+            if self._measure is None:
+                w = AVERAGE_WIDTH
+            else:
+                w = self._measure(char)
+            self._widths[char] = w
+            return w
+
+    def string_width(self, txt, size):
+        """
+        Returns the width of txt in points
+        @param txt: The string to measure (UTF-8 encoded, if a byte string)
+        @param size: The font size in points
+        """
+
+        txt = decode(txt)
+
+        widths = self._widths
+        total = 0
+        for c in txt:
+            w = widths.get(c)
+            if w is None:
+                w = self[c]
+            total += w
+
+        return total * size / 1000.0
+
+class ResolvedFont(collections.namedtuple("ResolvedFont", "face size ascent descent widths")):
+    """
+    A font as actually used by a renderer: an immutable record of the face and its metrics.
+    @ivar face: The name of the face
+    @ivar size: The size in points
+    @ivar ascent: The height above the baseline, in points
+    @ivar descent: The depth below the baseline, in points (usually negative)
+    @ivar widths: The face's GlyphWidths table
+    """
+    __slots__ = ()
+
+# Glyph tables, by face name
+_tables = dict()
+
+def get_glyph_widths(face, measure = None):
+    """
+    Returns the (cached) glyph width table of the given face
+    @param face: The font face's name
+    @param measure: The measure function used to fill a new table. Look at GlyphWidths
+    """
+
+    try:
+        return _tables[face]
+    except KeyError:
+        table = _tables.setdefault(face, GlyphWidths(face, measure))
+        return table
+
+def line_height(size):
+    """
+    Returns the height of a text line, in millimeters
+    @param size: The font size in points
+    """
+    return size * LEADING / PT_PER_MM
+
+def wrap_text(txt, widths, size, max_width):
+    """
+    Breaks txt into lines no wider than max_width. Lines are broken on spaces
+    and on explicit newlines; words longer than a whole line are broken
+    between characters.
+    @param txt: The text to wrap
+    @param widths: The face's GlyphWidths table
+    @param size: The font size in points
+    @param max_width: The maximum line width, in points
+    @returns: A list of lines, of the same type as txt (UTF-8 encoded, if a byte string)
+    """
+
+    encoded = isinstance(txt, str)
+    txt = decode(txt)
+
+    # Work in font units, so we don't have to scale each glyph
+    limit = max_width * 1000.0 / size
+    space = widths[" "]
+
+    lines = list()
+
+    for paragraph in txt.split("\n"):
+        line = list()
+        line_width = 0
+
+        for word in paragraph.split(" "):
+            word_width = 0
+            for c in word:
+                word_width += widths[c]
+
+            if line:
+                if line_width + space + word_width <= limit:
+                    line.append(word)
+                    line_width += space + word_width
+                    continue
+
+                lines.append(" ".join(line))
+                line = list()
+                line_width = 0
+
+            if word_width > limit:
+                # Break the word between characters
+                start = 0
+                w = 0
+                for i, c in enumerate(word):
+                    cw = widths[c]
+                    if w + cw > limit and i > start:
+                        lines.append(word[start:i])
+                        start = i
+                        w = 0
+                    w += cw
+                word = word[start:]
+                word_width = w
+
+            line.append(word)
+            line_width = word_width
+
+        lines.append(" ".join(line))
+
+    if encoded:
+        return [line.encode("utf-8") for line in lines]
+    return lines
+
+# Fitted strings, by (text, face, size, width, ellipsis)
+_fitted = dict()
+
+def fit_text(txt, widths, size, max_width, ellipsis = False):
+    """
+    Cuts txt to the longest prefix no wider than max_width. Results are cached, 
+    so fitting a value already seen costs a dictionary lookup.
+    @param txt: The text to fit
+    @param widths: The face's GlyphWidths table
+    @param size: The font size in points
+    @param max_width: The maximum width, in points
+    @param ellipsis: If True, a cut text ends with ELLIPSIS (still within max_width)
+    @returns: The fitted text, of the same type as txt (UTF-8 encoded, if a byte string)
+    """
+
+    encoded = isinstance(txt, str)
+    txt = decode(txt)
+
+    key = (txt, widths.face, size, max_width, ellipsis)
+    try:
+        fitted = _fitted[key]
+    except KeyError:
+        fitted = _fit_text(txt, widths, size, max_width, ellipsis)
+        if len(_fitted) >= FIT_CACHE_SIZE:
+            _fitted.clear()
+        _fitted[key] = fitted
+
+    if encoded:
+        return fitted.encode("utf-8")
+    return fitted
+
+def _fit_text(txt, widths, size, max_width, ellipsis):
+
+    limit = max_width * 1000.0 / size
+
+    # Prefix sums of the glyph widths: prefix[i] is the width of txt[:i + 1]
+    prefix = list()
+    total = 0
+    for c in txt:
+        total += widths[c]
+        prefix.append(total)
+
+    if total <= limit:
+        fitted = txt
+    elif ellipsis:
+        for c in ELLIPSIS:
+            limit -= widths[c]
+        if limit < 0:
+            fitted = ""
+        else:
+            fitted = txt[:bisect.bisect_right(prefix, limit)] + ELLIPSIS
+    else:
+        fitted = txt[:bisect.bisect_right(prefix, limit)]
+
+    return fitted
@@ -0,0 +1,357 @@
+# Copyright(c) 2005-2007 Angelantonio Valente
+# See LICENSE file for details.
+
+"""
+Benchmarks.
+
+Run from the tests directory: python benchmarks.py [name ...]
+Without arguments, every benchmark is run.
+"""
+
+import os
+import sys
+import time
+sys.path.append("..")
+
+import sqlite3
+
+from pyrep import *
+from pyrep import dataproviders
+
+import test_prepared
+
+def timed(func, repeat):
+    """
+    Calls func repeat times, returns the average time of a call in milliseconds
+    """
+    start = time.time()
+    for i in range(repeat):
+        func(i)
+    return (time.time() - start) * 1000.0 / repeat
+
+def make_database(path, rows):
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS test_table")
+    cur.execute("CREATE TABLE test_table(id int not null primary key, description varchar(50))")
+    for x in range(rows):
+        cur.execute("INSERT INTO test_table(id, description) values(?, ?)", (x, "Desc %s"%(x + 1)))
+    conn.commit()
+    conn.close()
+
+def bench_prepared(repeat = 50):
+    """
+    Per-render overhead: parsing and rendering the template on each call, against rendering a prepared report
+    """
+
+    dbfile = "out/bench_prepared.db"
+    make_database(dbfile, 20)
+
+    outfile = "out/bench_prepared.pdf"
+
+    def cold(i):
+        report = XMLParser(xmlcontent = test_prepared.report_xml).parse()
+        report.parameters['customer'].value = "Customer %s"%i
+        conn = sqlite3.connect(dbfile)
+        PDFRenderer(report).render(module = sqlite3, conn = conn, outfile = outfile)
+        conn.close()
+
+    prepared = PreparedReport(xmlcontent = test_prepared.report_xml, module = sqlite3, conn_pars = ((dbfile, ), ))
+
+    def warm(i):
+        prepared.render(dict(customer = "Customer %s"%i), outfile)
+
+    print "prepared: cold %.2f ms/render, prepared %.2f ms/render"%(timed(cold, repeat), timed(warm, repeat))
+
+def make_template_xml(elements = 10000):
+    """
+    The XML code of a large template: a body band of "elements" objects, texts and lines
+    """
+
+    code = ["""<?xml version="1.0" standalone="no"?>
+<report pagesize="A4">
+    <font id="small" face="Helvetica" size="8" />
+    <body height="25cm" font="small">
+"""]
+
+    for i in range(elements):
+        x, y = (i % 10) * 19, (i // 10) % 250
+        if i % 5:
+            code.append("""        <text x="%smm" y="%smm" width="19" height="1" alignment="right">
+            "Field %s: %%s"%%(row * %s)
+        </text>
+"""%(x, y, i, i))
+        else:
+            code.append("""        <hline x="%smm" y="%smm" width="19" />
+"""%(x, y))
+
+    code.append("""    </body>
+</report>
+""")
+
+    return "".join(code)
+
+def bench_parse(elements = 10000):
+    """
+    Parsing time and peak memory growth of a large template. Run it first (python benchmarks.py parse):
+    the memory peak of the earlier benchmarks hides the parser's one
+    """
+
+    import resource
+
+    xml = make_template_xml(elements)
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    XMLParser(xmlcontent = xml).parse()
+    elapsed = time.time() - start
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+
+    print "parse: %d elements (%d KB) in %.2f s, peak memory growth %.1f MB"%(elements, len(xml) / 1024, elapsed, growth / 1024.0)
+
+def bench_template_cache(repeat = 20):
+    """
+    Loading a template: parsing it on each load, against reading the parsed report from the template cache
+    """
+
+    import shutil
+    from pyrep import templatecache
+
+    cache_dir = "out/bench_template_cache"
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+
+    for name, xml, count in (("test", test_prepared.report_xml, repeat * 10), ("10000 elements", make_template_xml(), repeat)):
+        parse = timed(lambda i: XMLParser(xmlcontent = xml).parse(), count)
+
+        # The first load writes the entry
+        templatecache.load_template(cache_dir, xmlcontent = xml)
+        cached = timed(lambda i: templatecache.load_template(cache_dir, xmlcontent = xml), count)
+
+        print "template_cache: %-14s parse %.1f ms/load, cached %.1f ms/load"%(name, parse, cached)
+
+def make_table_report(columns = 6):
+    """
+    A dense tabular report: a header, a footer, and a body row of "columns" text fields plus a separator line
+    """
+
+    c = Report()
+
+    c.header.size = (-1, cm(1.5))
+    c.body.size = (-1, cm(0.4))
+    c.footer.size = (-1, cm(1))
+
+    width = 190.0 / columns
+
+    for i in range(columns):
+        c.header.add_child( (width * i, cm(1)), Text( (width, 4), value = "'Column %s'"%(i + 1), font = Font(None, "Helvetica", 9, style = [Font.BOLD])))
+        c.body.add_child( (width * i, 0), Text( (width, 4), value = "'Row %%s, value %s'%%row"%i, font = Font(None, "Helvetica", 8),
+                                               alignment = (Text.ALIGN_LEFT, Text.ALIGN_RIGHT)[i % 2]))
+
+    c.header.add_child( (0, cm(1.4)), HLine())
+    c.body.add_child( (0, 3.9), HLine(linewidth = 0.1, linecolor = Color(200, 200, 200)))
+    c.footer.add_child( (cm(18), cm(0.5)), Text( (10, 4), value = "'Page %s'%system.page"))
+
+    return c
+
+def bench_pdf(rows = 10000):
+    """
+    PDF rendering time and output size of a dense tabular report
+    """
+
+    report = make_table_report()
+
+    for streaming in (False, True):
+        outfile = "out/bench_pdf.pdf"
+        start = time.time()
+        PDFRenderer(report).render(datasources = [dataproviders.DataProvider(range(rows))], outfile = outfile, streaming = streaming)
+        elapsed = time.time() - start
+
+        print "pdf (streaming: %s): %d rows in %.2f s (%.0f rows/s), %d bytes"%(streaming, rows, elapsed, rows / elapsed, os.path.getsize(outfile))
+
+def bench_direct(rows = 10000, repeat = 5):
+    """
+    Throughput and output size of the PDF backends, on the dense tabular report and on the test suite's reports
+    """
+
+    import test_renderers
+
+    reports = [("table", make_table_report(), [dataproviders.DataProvider(range(rows))], 1)]
+
+    class _Collector(test_renderers.TestRenderers):
+        def _run_report(self, report, datasrc = None):
+            reports.append((self._testMethodName, report, datasrc, repeat))
+
+    for name in ("testSections", "testSimple", "testCalcs", "testBox", "testStretch"):
+        getattr(_Collector(name), name)()
+
+    backends = (("reportlab", PDFRenderer, {}),
+                ("streaming", PDFRenderer, dict(streaming = True)),
+                ("direct", DirectPDFRenderer, {}))
+
+    outfile = "out/bench_direct.pdf"
+
+    for name, report, datasrc, count in reports:
+        for backend, renderer, kwargs in backends:
+            kwargs = dict(kwargs, outfile = outfile)
+            if datasrc is not None:
+                kwargs["datasources"] = datasrc
+
+            elapsed = timed(lambda i: renderer(report).render(**kwargs), count)
+
+            print "direct: %-12s %-10s %8.1f ms/render, %d bytes"%(name, backend, elapsed, os.path.getsize(outfile))
+
+def bench_compress(rows = 10000):
+    """
+    Direct PDF rendering time and output size by compression level and number of compression threads
+    """
+
+    report = make_table_report()
+    outfile = "out/bench_compress.pdf"
+
+    for level in (1, 6, 9):
+        for workers in (0, 2, 4):
+            start = time.time()
+            DirectPDFRenderer(report).render(datasources = [dataproviders.DataProvider(range(rows))], outfile = outfile,
+                                             compress_level = level, compress_workers = workers)
+            elapsed = time.time() - start
+
+            print "compress: level %s, %s workers: %.2f s, %d bytes"%(level, workers, elapsed, os.path.getsize(outfile))
+
+def bench_chunks():
+    """
+    Time to first byte and total time of chunked output, by report length
+    """
+
+    report = make_table_report()
+
+    for pages in (10, 100, 1000):
+        rows = pages * 63
+        start = time.time()
+        chunks = DirectPDFRenderer(report).render(datasources = [dataproviders.DataProvider(range(rows))], output = "chunks")
+        chunks.next()
+        first = time.time() - start
+        for chunk in chunks:
+            pass
+        total = time.time() - start
+
+        print "chunks: %4d pages, first chunk in %.3f s, all chunks in %.2f s"%(pages, first, total)
+
+class CountingFile(object):
+    """
+    An unbuffered output file counting its write calls: each one is a write syscall
+    """
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        os.write(self.fd, data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+def bench_html(rows = 100000):
+    """
+    HTML rendering time, write syscalls and output size, by buffer size and compression
+    """
+
+    from pyrep.htmlrenderer import HTMLRenderer
+
+    report = make_table_report()
+
+    # A buffer of 0 bytes writes each element on its own, as the renderer used to
+    for buffer_size, gzip in ((0, False), (8192, False), (65536, False), (65536, True)):
+        out = CountingFile("out/bench_html.html")
+        start = time.time()
+        HTMLRenderer(report).render(datasources = [dataproviders.DataProvider(range(rows))], outfile = out,
+                                    buffer_size = buffer_size, gzip = gzip)
+        elapsed = time.time() - start
+        out.close()
+
+        print "html: buffer %5d, gzip %-5s: %.2f s, %6d write syscalls, %d bytes"%(buffer_size, gzip, elapsed, out.writes,
+                                                                                   os.path.getsize("out/bench_html.html"))
+
+def bench_tabular(rows = 100000):
+    """
+    CSV export time of the dense tabular report's body, against a full layout run
+    """
+
+    report = make_table_report()
+
+    start = time.time()
+    TabularRenderer(report).render(datasources = [dataproviders.DataProvider(range(rows))], outfile = "out/bench_tabular.csv")
+    elapsed = time.time() - start
+
+    print "tabular: csv, %d rows in %.2f s (%.0f rows/s)"%(rows, elapsed, rows / elapsed)
+
+    start = time.time()
+    DirectPDFRenderer(report).render(datasources = [dataproviders.DataProvider(range(rows))], outfile = "out/bench_tabular.pdf")
+    elapsed = time.time() - start
+
+    print "tabular: direct pdf, %d rows in %.2f s (%.0f rows/s)"%(rows, elapsed, rows / elapsed)
+
+def bench_svg(rows = 10000):
+    """
+    SVG rendering time of the dense tabular report, by number of worker processes
+    """
+
+    report = make_table_report()
+
+    for workers in (0, 2, 4):
+        start = time.time()
+        paths = SVGRenderer(report).render(datasources = [dataproviders.DataProvider(range(rows))], outdir = "out/bench_svg",
+                                           workers = workers)
+        elapsed = time.time() - start
+
+        print "svg: %s workers, %d pages in %.2f s"%(workers, len(paths), elapsed)
+
+def bench_engine(rows = 100000):
+    """
+    Engine throughput (pagination, expressions, calculations) of the dense tabular report, without any output
+    """
+
+    report = make_table_report()
+
+    timing = NullRenderer(report).render(datasources = [dataproviders.DataProvider(range(rows))], timing = True)
+
+    print "engine: %d rows, %d pages in %.2f s: %.0f rows/s, %.1f pages/s"%(timing.rows, timing.pages, timing.seconds,
+                                                                         timing.rows_per_second, timing.pages_per_second)
+
+def bench_tee(rows = 10000):
+    """
+    Rendering the dense tabular report to PDF and HTML: one renderer after the other, against one TeeRenderer pass
+    """
+
+    from pyrep.htmlrenderer import HTMLRenderer
+
+    report = make_table_report()
+
+    start = time.time()
+    DirectPDFRenderer(report).render(datasources = [dataproviders.DataProvider(range(rows))], outfile = "out/bench_tee.pdf")
+    HTMLRenderer(report).render(datasources = [dataproviders.DataProvider(range(rows))], outfile = "out/bench_tee.html")
+    sequential = time.time() - start
+
+    start = time.time()
+    TeeRenderer(report).render(datasources = [dataproviders.DataProvider(range(rows))],
+                               targets = [(DirectPDFRenderer, dict(outfile = "out/bench_tee.pdf")),
+                                          (HTMLRenderer, dict(outfile = "out/bench_tee.html"))])
+    tee = time.time() - start
+
+    print "tee: pdf + html, %d rows: %.2f s one after the other, %.2f s in one pass"%(rows, sequential, tee)
+
+benchmarks = dict((name[6:], func) for name, func in globals().items() if name.startswith("bench_"))
+
+if __name__ == "__main__":
+    if not os.path.isdir("out"):
+        os.mkdir("out")
+
+    names = sys.argv[1:] or sorted(benchmarks)
+
+    for name in names:
+        benchmarks[name]()
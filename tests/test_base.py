@@ -30,6 +30,9 @@ class TestBaseClasses(unittest.TestCase):
         self.assertEqual(c[2], 33)
         
         self.assertEqual(tuple(c), (11, 22, 33))
+        
+        self.assertEqual(c.to_hex(), "#0B1621")
+        self.assertEqual(Color.from_hex(c.to_hex()), c)
     
     def testSize(self):
         s = Size(19, 82)
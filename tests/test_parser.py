@@ -160,6 +160,10 @@ class TestParser(unittest.TestCase):
 
         r = PDFRenderer(report)
         r.render(datasources = [dataproviders.DataProvider(datasource)], outfile = "out/%s.pdf"%self._testMethodName)
+        
+        # The given content is parsed, even with a file name
+        report = XMLParser(filename = "missing/report.xml", xmlcontent = simple_xml).parse()
+        self.assertEqual(report.body.height, p.parse().body.height)
 
     def testFileParser(self):
         conn = sqlite3.connect(":memory:")
@@ -177,6 +181,30 @@ class TestParser(unittest.TestCase):
         r = PDFRenderer(report)
         r.render(module = sqlite3, conn = conn, outfile = "out/%s.pdf"%self._testMethodName)
 
+    def testTextNodes(self):
+        report = XMLParser(xmlcontent = """<report><body height="1cm">
+            <text width="10" height="5">
+                "a &amp; b" <![CDATA[ skipped ]]> + "c" <!-- comment -->
+                + "d" <nested>skipped</nested> + "e"
+            </text>
+        </body></report>""").parse()
+        
+        self.assertEqual(report.body.children[0].value, '"a & b"\n+ "c"\n+ "d"\n+ "e"')
+    
+    def testErrors(self):
+        from pyrep.base import ReportError
+        
+        for xml, message in (('<other/>', "None: Invalid report file! Root element is <other>"),
+                             ('<report><body></report>', "Parsing error:\nmismatched tag: line 1, column 16"),
+                             ('<report><font id="f" size="10"/></report>', "Font face not specified"),
+                             ('<report><body height="1cm"><text x="1zz" height="5"/></body></report>', "Invalid unit: zz")):
+            try:
+                XMLParser(xmlcontent = xml).parse()
+            except ReportError, e:
+                self.assertEqual(str(e), message)
+            else:
+                self.fail("No error for %s"%xml)
+
 suite = unittest.makeSuite(TestParser)
 
 __all__=["suite"]
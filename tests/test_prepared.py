@@ -0,0 +1,140 @@
+from pyrep import *
+from pyrep import dataproviders
+
+import threading
+import unittest
+import sqlite3
+
+report_xml="""<?xml version="1.0" standalone="no"?>
+
+<!DOCTYPE report SYSTEM "report.dtd">
+
+<report pagesize="A4">
+    <datasources>
+        <datasource name="main" type="dbapi2" engine="sqlite">
+        select id, description from test_table order by id
+        </datasource>
+    </datasources>
+
+    <parameter name="customer" type="string" value="Nobody" />
+
+    <header height="2cm">
+        <text width="10cm" height="0.5cm">
+            "Customer: %s"%parameters.customer
+        </text>
+        
+        <hline y="1.9cm" />
+    </header>
+
+    <body height="0.5cm">
+        <text width="30" height="0.5" alignment="right">
+            row['id']
+        </text>
+        
+        <text x="4cm" width="30" height="0.5">
+            row['description']
+        </text>
+    </body>
+
+    <footer height="2cm">
+        <text x="17cm" y="1cm" width="10" height="0.5">
+            "Page: %s"%system.page
+        </text>
+    </footer>
+</report>
+"""
+
+class TestPrepared(unittest.TestCase):
+    def setUp(self):
+        self.dbfile = "out/%s.db"%self._testMethodName
+        
+        conn = sqlite3.connect(self.dbfile)
+        cur = conn.cursor()
+        cur.execute("DROP TABLE IF EXISTS test_table")
+        cur.execute("CREATE TABLE test_table(id int not null primary key, description varchar(50))")
+        for x in range(120):
+            cur.execute("INSERT INTO test_table(id, description) values(?, ?)", (x, "Desc %s"%(x + 1)))
+        conn.commit()
+        conn.close()
+        
+    def testParameters(self):
+        p = PreparedReport(xmlcontent = report_xml, module = sqlite3, conn_pars = ((self.dbfile, ), ))
+        
+        self.assertEqual(p.report.parameters['customer'].value, "Nobody")
+        
+        p.render(dict(customer = "ACME"), "out/%s.pdf"%self._testMethodName)
+        
+        # The template is never changed by a render
+        self.assertEqual(p.report.parameters['customer'].value, "Nobody")
+        self.assertEqual(p.report.header.y, 0)
+        self.assertEqual(p.report.body.y, 0)
+        self.assertEqual(p.report.footer.y, 0)
+        
+        self.assertRaises(ReportError, p.render, dict(nonexistent = 1), "out/%s.pdf"%self._testMethodName)
+    
+    def testThreads(self):
+        p = PreparedReport(xmlcontent = report_xml, module = sqlite3, conn_pars = ((self.dbfile, ), dict(check_same_thread = False)))
+        
+        errors = list()
+        
+        def run(n):
+            try:
+                p.render(dict(customer = "Customer %s"%n), "out/%s_%s.pdf"%(self._testMethodName, n))
+            except Exception, e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target = run, args = (n, )) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        self.assertEqual(errors, [])
+
+    def testCache(self):
+        import glob
+        import os
+        import shutil
+        
+        cache_dir = "out/template_cache"
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir)
+        
+        kwargs = dict(xmlcontent = report_xml, module = sqlite3, conn_pars = ((self.dbfile, ), ), renderer = DirectPDFRenderer)
+        expected = PreparedReport(**kwargs).render(dict(customer = "Test"), output = "bytes")
+        
+        # Written on the first load, read on the next ones
+        for i in range(2):
+            p = PreparedReport(cache_dir = cache_dir, **kwargs)
+            self.assertEqual(p.render(dict(customer = "Test"), output = "bytes"), expected)
+        
+        entries = glob.glob(os.path.join(cache_dir, "*.pyrep"))
+        self.assertEqual(len(entries), 1)
+        
+        # A corrupted entry is parsed again
+        f = open(entries[0], "wb")
+        f.write("garbage")
+        f.close()
+        
+        p = PreparedReport(cache_dir = cache_dir, **kwargs)
+        self.assertEqual(p.render(dict(customer = "Test"), output = "bytes"), expected)
+        self.assertNotEqual(open(entries[0], "rb").read(), "garbage")
+        
+        # Another content is another entry
+        PreparedReport(cache_dir = cache_dir, **dict(kwargs, xmlcontent = report_xml.replace("Page: ", "Page ")))
+        self.assertEqual(len(glob.glob(os.path.join(cache_dir, "*.pyrep"))), 2)
+        
+        # So are other PyRep sources
+        from pyrep import templatecache
+        
+        fingerprint = templatecache._get_fingerprint()
+        try:
+            templatecache._fingerprint = "changed"
+            PreparedReport(cache_dir = cache_dir, **kwargs)
+        finally:
+            templatecache._fingerprint = fingerprint
+        self.assertEqual(len(glob.glob(os.path.join(cache_dir, "*.pyrep"))), 3)
+
+suite = unittest.makeSuite(TestPrepared)
+
+__all__=["suite"]
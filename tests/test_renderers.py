@@ -1,15 +1,21 @@
 from pyrep import *
-from pyrep.pdfrenderer import PDFRenderer
+from pyrep.pdfrenderer import PDFRenderer, GraphicsState
 from pyrep.htmlrenderer import HTMLRenderer
 from pyrep import dataproviders
+from pyrep import textlayout
+from pyrep import pdfwriter
 
+import re
+from cStringIO import StringIO
 import unittest
+import zlib
 
 class TestRenderers(unittest.TestCase):
     def _run_report(self, report, datasrc = None):
         
         renderers = (
             (PDFRenderer, "pdf"),
+            (DirectPDFRenderer, "direct.pdf"),
             (HTMLRenderer, "html")
         )
         
@@ -143,6 +149,751 @@ class TestRenderers(unittest.TestCase):
 
         self._run_report(c, [dataproviders.DataProvider(range(1))])
         
+    def testLines(self):
+        c = Report()
+        c.body.size = (-1, cm(2))
+        c.body.add_child( cm(1, 0), HLine(50) )
+        c.body.add_child( cm(7, 0), VLine(20) )
+        
+        # The same lines in both PDF backends: 50 mm (141.73 points) long, then 20 mm (56.69 points)
+        for class_, kwargs in ((PDFRenderer, dict(streaming = True)), (DirectPDFRenderer, {})):
+            data = class_(c).render(datasources = [dataproviders.DataProvider(range(1))], output = "bytes", **kwargs)
+            start = data.index("stream\n") + 7
+            code = zlib.decompress(data[start:data.index("\nendstream", start)])
+            
+            self.assertEqual(re.findall("([\\d.]+) ([\\d.]+) m ([\\d.]+) ([\\d.]+) l S", code), 
+                             [("28.346", "841.89", "170.079", "841.89"), ("198.425", "841.89", "198.425", "785.197")])
+        
+    def testStretch(self):
+        c = Report()
+        
+        c.header.size = (-1, cm(1))
+        c.body.size = (-1, cm(0.5))
+        c.footer.size = (-1, cm(1))
+        
+        c.header.add_child( cm(0, 0), Text( (cm(5), 5), value = "'Stretch Test'"))
+        c.body.add_child( cm(0, 0), Text( (cm(2), 5), value = "funcs.str(row)", alignment = Text.ALIGN_RIGHT))
+        c.body.add_child( cm(3, 0), Text( (cm(6), 5), value = "' '.join(['word'] * (row * 5))", stretch = True))
+        c.footer.add_child( cm(17, 0), Text( (10, 0.5), value = "system.page"))
+        
+        self._run_report(c, [dataproviders.DataProvider(range(60))])
+        
+        # Unstretched, the 60 rows would fit on a single page. Every row is printed once
+        pages = PDFRenderer(c).paginate(datasources = [dataproviders.DataProvider(range(60))])
+        self.assert_(len(pages) > 1)
+        self.assertEqual([x for first, last in pages for x in range(first, last + 1)], range(1, 61))
+        
+        # Rows of a known height: one line of 10 points is 4.23 mm high, so the body is 5 mm
+        # high for one line and 42.33 mm for ten. 277 mm are left between header and footer
+        c = Report()
+        
+        c.header.size = (-1, cm(1))
+        c.body.size = (-1, cm(0.5))
+        c.footer.size = (-1, cm(1))
+        
+        c.body.add_child( cm(3, 0), Text( (cm(6), 5), value = "'\\n'.join(['line'] * row)", stretch = True, 
+                                          font = Font(None, "Helvetica", 10)))
+        
+        rows = [1] * 10 + [10] * 13
+        pages = PDFRenderer(c).paginate(datasources = [dataproviders.DataProvider(rows)])
+        self.assertEqual(pages, [(1, 15), (16, 21), (22, 23)])
+        
+        # 70 lines are 296.33 mm high: they don't fit on any page
+        try:
+            PDFRenderer(c).paginate(datasources = [dataproviders.DataProvider([1, 70])])
+        except ReportError, e:
+            self.assert_(str(e).startswith("Body band too high for the page (row 2,"))
+        else:
+            self.fail("ReportError not raised")
+        
+        # The first page has less room, because of the title: a row too high for it goes to the second page
+        c.title.size = (-1, cm(20))
+        self.assertEqual(PDFRenderer(c).paginate(datasources = [dataproviders.DataProvider([30])]), [None, (1, 1)])
+        self.assertEqual(PDFRenderer(c).paginate(datasources = [dataproviders.DataProvider([1, 30])]), [(1, 1), (2, 2)])
+        
+        # Texts showing variables are measured with the current row's values. The rows moved
+        # to the next page are counted there
+        c = Report()
+        
+        c.add_variable( Variable('lines', "integer", 0) )
+        c.add_variable( Variable('rows', "integer", 0) )
+        c.add_calculation( Calculation("assign", c.variables['lines'], "row") )
+        c.add_calculation( Calculation("sum", c.variables['rows'], "1", "page") )
+        
+        c.header.size = (-1, cm(1))
+        c.body.size = (-1, cm(0.5))
+        c.footer.size = (-1, cm(1))
+        
+        c.body.add_child( cm(3, 0), Text( (cm(6), 5), value = "'\\n'.join(['line'] * vars.lines)", stretch = True, 
+                                          font = Font(None, "Helvetica", 10)))
+        c.footer.add_child( cm(0, 0), Text( (cm(6), 5), value = "'Rows: %s'%vars.rows"))
+        
+        pages = PDFRenderer(c).paginate(datasources = [dataproviders.DataProvider(rows)])
+        self.assertEqual(pages, [(1, 15), (16, 21), (22, 23)])
+        
+        class _Recorder(HTMLRenderer):
+            def draw_text(self, text, environment = None):
+                value = self.safe_eval(text.value, environment)
+                if value.startswith("Rows"):
+                    self.values.append(value)
+        
+        r = _Recorder(c)
+        r.values = list()
+        r.render(datasources = [dataproviders.DataProvider(rows)], output = "bytes")
+        self.assertEqual(r.values, ["Rows: 15", "Rows: 6", "Rows: 2"])
+    
+    def testStreaming(self):
+        c = Report()
+        
+        c.header.size = (-1, cm(2))
+        c.body.size = (-1, cm(0.5))
+        c.footer.size = (-1, cm(2))
+        
+        c.header.add_child( cm(0, 1.4), Text( (30, 0.5), value = "\"Column1\"", alignment = Text.ALIGN_RIGHT))
+        c.header.add_child( cm(0, 1.9), HLine() )
+        c.header.add_child( cm(15, 0), Box( (cm(4), cm(1.5)), round = 3, fillcolor = Color(250, 240, 200)))
+        c.body.add_child(cm(0,0), Text( (30,0.5), value = "funcs.str(row)", alignment = Text.ALIGN_RIGHT))
+        c.body.add_child(cm(4,0), Text( (30,0.5), value = "'Value (%s)'%(row+1)"))
+        c.footer.add_child(cm(17,1), Text( (10,0.5), value = "system.page", alignment = Text.ALIGN_CENTER))
+        
+        outfile = "out/%s.pdf"%self._testMethodName
+        PDFRenderer(c).render(datasources = [dataproviders.DataProvider(range(500))], outfile = outfile, streaming = True)
+        
+        data = open(outfile, "rb").read()
+        
+        self.assert_(data.startswith("%PDF-"))
+        self.assert_(data.endswith("%%EOF\n"))
+        self.assertEqual(data.count("/Type /Page "), 10)
+        
+    def testParallelCompression(self):
+        c = Report()
+        
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(0,0), Text( (30,0.5), value = "'Value (%s)'%(row+1)"))
+        
+        # The pages are written in order: the output is the same
+        outputs = list()
+        for workers in (0, 3):
+            outfile = "out/%s_%s.pdf"%(self._testMethodName, workers)
+            DirectPDFRenderer(c).render(datasources = [dataproviders.DataProvider(range(1000))], outfile = outfile, 
+                                        compress_level = 9, compress_workers = workers)
+            outputs.append(open(outfile, "rb").read())
+        
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0].count("/Type /Page "), 17)
+        
+    def testFailedRender(self):
+        import threading
+        
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        
+        # Fails on the 300th row, after some pages have been handed to the compression threads
+        c.body.add_child(cm(0,0), Text( (30,0.5), value = "'Value (%s)'%(1 / (row - 299))"))
+        
+        def datasrc():
+            return [dataproviders.DataProvider(range(1000))]
+        
+        threads = threading.active_count()
+        
+        self.assertRaises(ReportError, DirectPDFRenderer(c).render, datasources = datasrc(), output = "bytes", compress_workers = 2)
+        self.assertRaises(ReportError, PDFRenderer(c).render, datasources = datasrc(), output = "bytes", streaming = True, 
+                          compress_workers = 2)
+        self.assertRaises(ReportError, TeeRenderer(c).render, datasources = datasrc(), 
+                          targets = [(DirectPDFRenderer, dict(output = "bytes", compress_workers = 2))])
+        
+        chunks = DirectPDFRenderer(c).render(datasources = datasrc(), output = "chunks", compress_workers = 2)
+        self.assertRaises(ReportError, list, chunks)
+        
+        # A consumer may also stop early
+        chunks = DirectPDFRenderer(c).render(datasources = datasrc(), output = "chunks", compress_workers = 2)
+        chunks.next()
+        chunks.close()
+        
+        self.assertEqual(threading.active_count(), threads)
+        
+    def testTrueType(self):
+        import os
+        import reportlab
+        from pyrep import pdfrenderer
+        
+        fontfile = os.path.join(os.path.dirname(reportlab.__file__), "fonts", "Vera.ttf")
+        
+        c = Report()
+        c.register_font(Font("vera", "Vera", 12), fontfile)
+        
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(0,0), Text( (50,0.5), value = "'Row %s'%row", font = "vera"))
+        
+        outfile = "out/%s.pdf"%self._testMethodName
+        for x in range(2):
+            PDFRenderer(c).render(datasources = [dataproviders.DataProvider(range(10))], outfile = outfile)
+        
+        # Parsed once, and only the used glyphs are embedded
+        self.assertEqual(pdfrenderer._truetype["Vera"][0], fontfile)
+        data = open(outfile, "rb").read()
+        self.assert_("/FontFile2" in data)
+        self.assert_(len(data) < os.path.getsize(fontfile) / 2)
+        
+        # A face can't come from two different files
+        c.font_files["Vera"] = fontfile.replace("Vera.ttf", "VeraBd.ttf")
+        self.assertRaises(ReportError, PDFRenderer(c).render, datasources = [dataproviders.DataProvider(range(1))], outfile = outfile)
+        
+    def testPicture(self):
+        from PIL import Image
+        
+        logo = "out/%s_logo.png"%self._testMethodName
+        Image.new("RGBA", (40, 20), (200, 30, 30, 128)).save(logo)
+        
+        data = open(logo, "rb").read()
+        other = "out/%s_other.jpg"%self._testMethodName
+        Image.new("RGB", (10, 10), (30, 30, 200)).save(other)
+        
+        c = Report()
+        
+        c.header.size = (-1, cm(2))
+        c.body.size = (-1, cm(1))
+        
+        c.header.add_child( cm(0, 0), Picture( (cm(4), cm(2)), value = quote(logo)))
+        c.body.add_child( cm(0, 0), Picture( (cm(1), cm(1)), value = "row"))
+        
+        # Blobs, file-like objects and binary strings
+        def rows():
+            return [(buffer(data), open(other, "rb"), data)[x % 3] for x in range(60)]
+        
+        for class_, kwargs in ((PDFRenderer, {}), (PDFRenderer, dict(streaming = True)), (DirectPDFRenderer, {})):
+            outfile = "out/%s.pdf"%self._testMethodName
+            class_(c).render(datasources = [dataproviders.DataProvider(rows())], outfile = outfile, **kwargs)
+            
+            # The logo is on every page, but each image is stored once (the logo along with its alpha mask)
+            output = open(outfile, "rb").read()
+            self.assertEqual(len(re.findall("/Type /Page\\b", output)), 3)
+            self.assertEqual(len(re.findall("/Subtype /Image\\b", output)), 3)
+        
+        html = HTMLRenderer(c).render(datasources = [dataproviders.DataProvider(rows())], output = "bytes")
+        self.assertEqual(html.count("data:image/"), 60)
+        
+        from pyrep import images
+        self.assertRaises(ReportError, images.load_image, "out/missing.png")
+        self.assertRaises(ReportError, images.load_image, "out/missing\0.png")
+        
+        # Binary strings are told from file names by their signature, null bytes or not
+        self.assert_(images.is_file_name(logo))
+        self.assertFalse(images.is_file_name(data))
+        self.assertFalse(images.is_file_name(open(other, "rb").read()))
+        self.assertFalse(images.is_file_name("\xff\xd8\xff\xe0JFIF"))
+        self.assertEqual(images.load_image(open(other, "rb").read()).width, 10)
+        
+    def testOutput(self):
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(0,0), Text( (30,5), value = "'Row %s'%row"))
+        
+        for class_, start in ((PDFRenderer, "%PDF-"), (DirectPDFRenderer, "%PDF-"), (HTMLRenderer, "<!DOCTYPE")):
+            datasources = [dataproviders.DataProvider(range(5))]
+            
+            data = class_(c).render(datasources = datasources, output = "bytes")
+            self.assert_(isinstance(data, str))
+            self.assert_(data.startswith(start))
+            
+            view = class_(c).render(datasources = datasources, output = "memoryview")
+            self.assert_(isinstance(view, memoryview))
+            self.assertEqual(len(view), len(data))
+            
+            # A file object is written, and left open
+            f = StringIO()
+            self.assert_(class_(c).render(datasources = datasources, outfile = f) is f)
+            self.assert_(f.getvalue().startswith(start))
+            
+        self.assertRaises(ReportError, PDFRenderer(c).render, output = "file")
+        
+    def testChunks(self):
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(0,0), Text( (30,5), value = "'Row %s'%row"))
+        
+        read = list()
+        def rows():
+            for x in range(300):
+                read.append(x)
+                yield x
+        
+        for class_ in (DirectPDFRenderer, HTMLRenderer):
+            del read[:]
+            chunks = class_(c).render(datasources = [dataproviders.DataProvider(rows())], output = "chunks")
+            
+            # The first page comes before the whole datasource is read
+            first = chunks.next()
+            self.assert_(len(read) < 100)
+            
+            chunks = [first] + list(chunks)
+            self.assertEqual(len(chunks), 6 + 1)
+            
+            data = class_(c).render(datasources = [dataproviders.DataProvider(range(300))], output = "bytes")
+            self.assertEqual("".join(chunks), data)
+        
+        # Without streaming, ReportLab's canvas writes the whole document at the end
+        chunks = list(PDFRenderer(c).render(datasources = [dataproviders.DataProvider(range(300))], output = "chunks"))
+        self.assertEqual(len(chunks), 1)
+        
+    def testHTMLWriter(self):
+        import gzip
+        
+        class _File(object):
+            def __init__(self):
+                self.writes = list()
+            def write(self, data):
+                self.writes.append(data)
+            def flush(self):
+                pass
+        
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(0,0), Text( (30,5), value = "'Row %s'%row"))
+        c.body.add_child((0, 4.5), HLine())
+        
+        f = _File()
+        HTMLRenderer(c).render(datasources = [dataproviders.DataProvider(range(1000))], outfile = f, buffer_size = 16384)
+        
+        data = "".join(f.writes)
+        self.assert_(len(f.writes) <= len(data) / 16384 + 1)
+        
+        compressed = HTMLRenderer(c).render(datasources = [dataproviders.DataProvider(range(1000))], output = "bytes", gzip = True)
+        self.assert_(len(compressed) < len(data) / 4)
+        self.assertEqual(gzip.GzipFile(fileobj = StringIO(compressed)).read(), data)
+        
+        # Each chunk is decodable as it comes
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = HTMLRenderer(c).render(datasources = [dataproviders.DataProvider(range(1000))], output = "chunks", gzip = True)
+        
+        decoded = [decompressor.decompress(x) for x in chunks]
+        self.assert_(decoded[0].startswith("<!DOCTYPE"))
+        self.assert_(decoded[0].endswith("</DIV>\n\n"))
+        self.assertEqual("".join(decoded), data)
+        
+    def testHTMLStyles(self):
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(0,0), Text( (30,5), value = "'Row %s'%row", color = Color(255, 0, 0)))
+        c.body.add_child(cm(3,0), Text( (30,5), value = "'Value %s'%row", color = Color(255, 0, 0)))
+        c.body.add_child((0, 4.5), HLine())
+        
+        data = HTMLRenderer(c).render(datasources = [dataproviders.DataProvider(range(100))], output = "bytes")
+        
+        # Both texts share the same class, declared once in the header
+        self.assertEqual(data.count("color: #FF0000"), 1)
+        self.assertEqual(data.count("border-style: solid"), 1)
+        self.assertEqual(len(re.findall(r'class="element s1" style="top: [\d.]+mm; left: [\d.]+mm; width: [\d.]+mm; height: [\d.]+mm"', data)), 200)
+        
+        # Values are escaped
+        c.body.add_child(cm(6,0), Text( (30,5), value = "'<%s & co>'%row"))
+        data = HTMLRenderer(c).render(datasources = [dataproviders.DataProvider(range(10))], output = "bytes")
+        self.assert_("&lt;9 &amp; co&gt;</DIV>" in data)
+        
+    def testPagedHTML(self):
+        import os
+        
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(0,0), Text( (30,5), value = "'Row %s'%row"))
+        
+        for rows in (300, 100):
+            index = HTMLRenderer(c).render(datasources = [dataproviders.DataProvider(range(rows))], outfile = "out/paged.html", paged = True)
+            
+            # Fragments of the previous, longer render are removed
+            names = sorted(os.listdir("out/paged_pages"))
+            self.assertEqual(names, ["page-%d.html"%(x + 1) for x in range(len(names))])
+            
+            pages = [open("out/paged_pages/" + x).read() for x in names]
+            self.assertEqual(sum(x.count("Row ") for x in pages), rows)
+            self.assert_(pages[0].startswith('<DIV class="page">'))
+        
+        data = open(index).read()
+        self.assert_('"paged_pages/page-"' in data)
+        self.assert_("Row" not in data)
+        
+        self.assertRaises(ReportError, HTMLRenderer(c).render, datasources = [dataproviders.DataProvider(range(10))], 
+                          output = "bytes", paged = True)
+        
+    def testTabular(self):
+        import csv
+        
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(5,0), Text( (30,5), value = "row * 2"))
+        c.body.add_child(cm(0,0), Text( (30,5), value = "'Row, %s'%row"))
+        c.body.add_child((0, 4.5), HLine())
+        c.footer.size = (-1, cm(1))
+        c.footer.add_child(cm(0,0), Text( (30,5), value = "undefined_name"))
+        
+        data = TabularRenderer(c).render(datasources = [dataproviders.DataProvider(range(1000))], output = "bytes", 
+                                         header = ["Name", "Double"])
+        
+        rows = list(csv.reader(StringIO(data)))
+        self.assertEqual(len(rows), 1001)
+        self.assertEqual(rows[0], ["Name", "Double"])
+        self.assertEqual(rows[10], ["Row, 9", "18"])
+        
+        c.body.add_child(cm(8,0), Text( (30,5), value = "1 / (row - 5)"))
+        self.assertRaises(ReportError, TabularRenderer(c).render, datasources = [dataproviders.DataProvider(range(10))], output = "bytes")
+        
+    def testXLSX(self):
+        import zipfile
+        from pyrep import tabularrenderer
+        
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(5,0), Text( (30,5), value = "row * 2"))
+        c.body.add_child(cm(0,0), Text( (30,5), value = "'Row %s'%row"))
+        
+        kwargs = dict(format = "xlsx", header = ["Name", "Double"], sheet = "Data")
+        
+        if tabularrenderer.xlsxwriter is None:
+            self.assertRaises(ReportError, TabularRenderer(c).render, datasources = [dataproviders.DataProvider(range(10))], 
+                              output = "bytes", **kwargs)
+            self.skipTest("XlsxWriter isn't installed")
+        
+        def cells(data):
+            # Strings are either inline or shared, depending on the writer's mode
+            archive = zipfile.ZipFile(StringIO(data))
+            names = archive.namelist()
+            self.assert_("xl/worksheets/sheet1.xml" in names)
+            return "".join(archive.read(x) for x in names if x in ("xl/worksheets/sheet1.xml", "xl/sharedStrings.xml"))
+        
+        data = TabularRenderer(c).render(datasources = [dataproviders.DataProvider(range(1000))], output = "bytes", **kwargs)
+        
+        sheet = cells(data)
+        self.assert_(">Name<" in sheet and ">Double<" in sheet)
+        self.assert_(">Row 0<" in sheet and ">Row 999<" in sheet)
+        self.assert_("<v>1998</v>" in sheet)
+        self.assert_('<row r="1001"' in sheet and '<row r="1002"' not in sheet)
+        self.assert_('name="Data"' in zipfile.ZipFile(StringIO(data)).read("xl/workbook.xml"))
+        
+        # The same workbook, written to a file object
+        out = StringIO()
+        self.assert_(TabularRenderer(c).render(datasources = [dataproviders.DataProvider(range(1000))], outfile = out, **kwargs) is out)
+        self.assertEqual(cells(out.getvalue()), sheet)
+        
+    def testSVG(self):
+        from xml.dom import minidom
+        
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(0,0), Text( (30,5), value = "'Row <%s>'%row", alignment = Text.ALIGN_RIGHT))
+        c.body.add_child((0, 4.5), HLine())
+        c.footer.size = (-1, cm(1))
+        c.footer.add_child(cm(0,0), Box( (30,5)))
+        
+        pages = SVGRenderer(c).render(datasources = [dataproviders.DataProvider(range(200))], output = "bytes")
+        self.assert_(len(pages) > 1)
+        
+        doc = minidom.parseString(pages[0])
+        self.assertEqual(doc.documentElement.getAttribute("width"), "210mm")
+        self.assertEqual(doc.getElementsByTagName("text")[0].getAttribute("text-anchor"), "end")
+        self.assertEqual(doc.getElementsByTagName("text")[0].firstChild.data, "Row <0>")
+        self.assertEqual(len(doc.getElementsByTagName("rect")), 1)
+        
+        # Pages written by the workers are the same. The pages of a previous render are removed
+        import glob
+        import multiprocessing
+        import os
+        
+        if not os.path.isdir("out/svg"):
+            os.makedirs("out/svg")
+        open("out/svg/page-99.svg", "w").close()
+        
+        paths = SVGRenderer(c).render(datasources = [dataproviders.DataProvider(range(200))], outdir = "out/svg", workers = 2)
+        self.assertEqual(paths, ["out/svg/page-%d.svg"%(x + 1) for x in range(len(pages))])
+        self.assertEqual([open(x).read() for x in paths], pages)
+        self.assertEqual(sorted(glob.glob("out/svg/page-*.svg")), sorted(paths))
+        
+        # The workers are stopped by the render that started them, a caller's pool is left running
+        self.assertEqual(multiprocessing.active_children(), [])
+        
+        pool = multiprocessing.Pool(2)
+        try:
+            self.assertEqual(SVGRenderer(c).render(datasources = [dataproviders.DataProvider(range(200))], output = "bytes", pool = pool), pages)
+            self.assertEqual(pool.apply(len, ("pool",)), 4)
+        finally:
+            pool.terminate()
+        
+    def testNull(self):
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(0,0), Text( (30,5), value = "'Row %s'%row"))
+        c.footer.size = (-1, cm(1))
+        c.footer.add_child(cm(0,0), Text( (30,5), value = "'Page %s'%system.page"))
+        
+        datasrc = [dataproviders.DataProvider(range(200))]
+        
+        timing = NullRenderer(c).render(datasources = datasrc, timing = True)
+        self.assertEqual(timing.rows, 200)
+        self.assertEqual(timing.pages, len(PDFRenderer(c).paginate(datasources = datasrc)))
+        
+        # A run too short to be timed has no rates
+        from pyrep.nullrenderer import Timing
+        self.assertEqual(Timing(200, 5, 0).rows_per_second, 0)
+        self.assertEqual(Timing(200, 5, 0.0).pages_per_second, 0)
+        self.assertEqual(Timing(200, 5, 4).rows_per_second, 50)
+        
+        # Expressions are evaluated
+        c.footer.add_child(cm(5,0), Text( (30,5), value = "undefined_name"))
+        self.assertRaises(ReportError, NullRenderer(c).render, datasources = datasrc)
+        
+    def testTee(self):
+        from pyrep.htmlrenderer import HTMLRenderer
+        
+        evaluated = list()
+        
+        class _Row(object):
+            def __init__(self, num):
+                self.num = num
+            @property
+            def value(self):
+                evaluated.append(self.num)
+                return "Row %s"%self.num
+        
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(0,0), Text( (30,5), value = "row.value"))
+        c.body.add_child((0, 4.5), HLine())
+        c.footer.size = (-1, cm(1))
+        c.footer.add_child(cm(0,0), Text( (30,5), value = "'Page %s'%system.page"))
+        
+        datasrc = [dataproviders.DataProvider([_Row(x) for x in range(200)])]
+        
+        pdf, html = TeeRenderer(c).render(datasources = datasrc, targets = [(DirectPDFRenderer, dict(output = "bytes", compress = False)), 
+                                                                            (HTMLRenderer, dict(output = "bytes"))])
+        self.assertEqual(evaluated, range(200))
+        
+        self.assertEqual(pdf, DirectPDFRenderer(c).render(datasources = datasrc, output = "bytes", compress = False))
+        self.assertEqual(html, HTMLRenderer(c).render(datasources = datasrc, output = "bytes"))
+        
+    def testTeePicture(self):
+        from PIL import Image
+        
+        other = "out/%s_other.png"%self._testMethodName
+        Image.new("RGB", (10, 10), (30, 30, 200)).save(other)
+        
+        c = Report()
+        c.body.size = (-1, cm(1))
+        c.body.add_child( cm(0, 0), Picture( (cm(1), cm(1)), value = "row"))
+        
+        # File-like objects are read once, by the tee: every target draws the image
+        def rows():
+            return [(other, open(other, "rb"))[x % 2] for x in range(60)]
+        
+        pdf, html = TeeRenderer(c).render(datasources = [dataproviders.DataProvider(rows())],
+                                          targets = [(DirectPDFRenderer, dict(output = "bytes", compress = False)),
+                                                     (HTMLRenderer, dict(output = "bytes"))])
+        
+        self.assertEqual(pdf, DirectPDFRenderer(c).render(datasources = [dataproviders.DataProvider(rows())], output = "bytes", compress = False))
+        self.assertEqual(html, HTMLRenderer(c).render(datasources = [dataproviders.DataProvider(rows())], output = "bytes"))
+        self.assertEqual(html.count("data:image/png;base64,"), 30)
+        
+    def testTeeFailure(self):
+        import os
+        from pyrep.htmlrenderer import HTMLRenderer
+        
+        c = Report()
+        c.body.size = (-1, cm(0.5))
+        c.body.add_child(cm(0,0), Text( (30,0.5), value = "'Value (%s)'%(1 / (row - 299))"))
+        
+        pdffile = "out/%s.pdf"%self._testMethodName
+        htmlfile = "out/%s.html"%self._testMethodName
+        for name in (pdffile, htmlfile):
+            if os.path.exists(name):
+                os.remove(name)
+        
+        def datasrc():
+            return [dataproviders.DataProvider(range(1000))]
+        
+        # Options handled by the renderers' render methods can't be honoured
+        self.assertRaises(ReportError, TeeRenderer(c).render, datasources = datasrc(), 
+                          targets = [(DirectPDFRenderer, dict(outfile = pdffile)), 
+                                     (HTMLRenderer, dict(outfile = htmlfile, paged = True))])
+        self.assertFalse(os.path.exists(pdffile))
+        
+        # The partial files are removed
+        self.assertRaises(ReportError, TeeRenderer(c).render, datasources = datasrc(), 
+                          targets = [(DirectPDFRenderer, dict(outfile = pdffile)), 
+                                     (HTMLRenderer, dict(outfile = htmlfile))])
+        self.assertFalse(os.path.exists(pdffile))
+        self.assertFalse(os.path.exists(htmlfile))
+        
+    def testTextBatching(self):
+        c = Report()
+        
+        c.header.size = (-1, cm(1))
+        c.body.size = (-1, cm(0.5))
+        
+        c.header.add_child( cm(0, 0), Text( (30, 0.5), value = "'Header'"))
+        c.header.add_child( cm(0, 0.9), HLine() )
+        c.body.add_child(cm(0,0), Text( (30,0.5), value = "funcs.str(row)", alignment = Text.ALIGN_RIGHT))
+        c.body.add_child(cm(4,0), Text( (30,0.5), value = "'Value (%s)'%(row+1)", alignment = Text.ALIGN_CENTER))
+        
+        outfile = "out/%s.pdf"%self._testMethodName
+        PDFRenderer(c).render(datasources = [dataproviders.DataProvider(range(10))], outfile = outfile, streaming = True)
+        
+        data = open(outfile, "rb").read()
+        start = data.index("stream\n") + 7
+        code = zlib.decompress(data[start:data.index("\nendstream", start)])
+        
+        # The header's text, then the line, then every body text in a single text object
+        self.assertEqual(code.count("BT"), 2)
+        self.assertEqual(code.count("Tj"), 21)
+        self.assertEqual(code.count("Tf"), 2)
+        self.assert_(code.index(" l S") < code.rindex("BT"))
+        
+    def _paged_report(self):
+        c = Report()
+        
+        c.add_variable( Variable('csum', "integer", 0) )
+        c.add_variable( Variable('psum', "integer", 0) )
+
+        c.add_calculation( Calculation("sum", c.variables['csum'], "row") )
+        c.add_calculation( Calculation("sum", c.variables['psum'], "row", "page") )
+        
+        c.title.size = (-1, cm(3))
+        c.header.size = (-1, cm(2))
+        c.body.size = (-1, cm(0.5))
+        c.footer.size = (-1, cm(2))
+        c.summary.size = (-1, cm(5))
+        
+        c.body.add_child(cm(0,0), Text( (30,0.5), value = "funcs.str(row)", alignment = Text.ALIGN_RIGHT))
+        c.footer.add_child(cm(5,1.5), Text( (5,0.5), value = "'Page %s sum: %s'%(system.page, vars.psum)"))
+        c.summary.add_child( cm(10,1.5), Text( (5, 0.5), value = "'Total: %s'%vars.csum"))
+        
+        return c
+    
+    def testPaginate(self):
+        c = self._paged_report()
+        
+        pages = PDFRenderer(c).paginate(datasources = [dataproviders.DataProvider(range(86))])
+        self.assertEqual(pages, [(1, 45), (46, 86)])
+        
+        # The summary doesn't fit on the last page
+        pages = PDFRenderer(c).paginate(datasources = [dataproviders.DataProvider(range(96))])
+        self.assertEqual(pages, [(1, 45), (46, 96), None])
+    
+    def testPageRange(self):
+        c = self._paged_report()
+        
+        class _Recorder(HTMLRenderer):
+            def draw_text(self, text, environment = None):
+                self.values.append(self.safe_eval(text.value, environment))
+                
+        r = _Recorder(c)
+        r.values = list()
+        r.render(datasources = [dataproviders.DataProvider(range(200))], outfile = "out/%s.html"%self._testMethodName, pages = (2, 3))
+        
+        # Page 2 holds rows 45 - 95, page 3 rows 96 - 146
+        self.assertEqual(r.values[0], "45")
+        self.assertEqual(r.values[51], "Page 2 sum: %s"%sum(range(45, 96)))
+        self.assertEqual(r.values[-1], "Page 3 sum: %s"%sum(range(96, 147)))
+        self.assertEqual(len(r.values), 51 * 2 + 2)
+        
+        r.values = list()
+        r.render(datasources = [dataproviders.DataProvider(range(200))], outfile = "out/%s.html"%self._testMethodName, pages = (4, 10))
+        
+        # Page 5 holds rows 198 and 199, then the summary and the footer
+        self.assertEqual(r.values[-2], "Total: %s"%sum(range(200)))
+        self.assertEqual(r.values[-1], "Page 5 sum: %s"%(198 + 199))
+        
+    def testWrapText(self):
+        widths = textlayout.GlyphWidths("test")
+        
+        # Each glyph is 500 units wide: 10 glyphs per line at size 10 and width 50
+        self.assertEqual(textlayout.wrap_text("aaaa bbbb cccc", widths, 10, 50), ["aaaa bbbb", "cccc"])
+        self.assertEqual(textlayout.wrap_text("aaaaaaaaaaaaaaa", widths, 10, 50), ["aaaaaaaaaa", "aaaaa"])
+        self.assertEqual(textlayout.wrap_text("aa\nbb", widths, 10, 50), ["aa", "bb"])
+        self.assertEqual(textlayout.wrap_text("", widths, 10, 50), [""])
+        
+        # UTF-8 byte strings are broken between characters
+        self.assertEqual(textlayout.wrap_text("\xc3\xa9" * 15, widths, 10, 50), ["\xc3\xa9" * 10, "\xc3\xa9" * 5])
+        self.assertEqual(textlayout.wrap_text(u"\xe9\xe9 \xe9", widths, 10, 10), [u"\xe9\xe9", u"\xe9"])
+        
+    def testFitText(self):
+        widths = textlayout.GlyphWidths("test")
+        
+        # Each glyph is 500 units wide: 10 glyphs fit at size 10 and width 50
+        self.assertEqual(textlayout.fit_text("a" * 8, widths, 10, 50), "a" * 8)
+        self.assertEqual(textlayout.fit_text("a" * 10, widths, 10, 50), "a" * 10)
+        self.assertEqual(textlayout.fit_text("a" * 25, widths, 10, 50), "a" * 10)
+        self.assertEqual(textlayout.fit_text("a" * 25, widths, 10, 50, True), "a" * 7 + "...")
+        self.assertEqual(textlayout.fit_text("a" * 25, widths, 10, 10, True), "")
+        
+        # UTF-8 byte strings are measured and cut by character
+        self.assertEqual(widths.string_width("caf\xc3\xa9", 10), 20)
+        self.assertEqual(textlayout.fit_text("\xc3\xa9" * 10, widths, 10, 50), "\xc3\xa9" * 10)
+        self.assertEqual(textlayout.fit_text("\xc3\xa9" * 25, widths, 10, 50, True), "\xc3\xa9" * 7 + "...")
+        self.assertEqual(textlayout.fit_text(u"\xe9" * 25, widths, 10, 50), u"\xe9" * 10)
+        
+    def testUnicode(self):
+        c = Report()
+        c.body.size = (-1, cm(1))
+        c.body.add_child(cm(0,0), Text( (100,5), value = "'caf\xc3\xa9 %s'%row"))
+        c.body.add_child(cm(11,0), Text( (8,5), value = "'\xc3\xa9t\xc3\xa9 ' * 10", ellipsis = True))
+        c.body.add_child(cm(13,0), Text( (10,5), value = "'\xc3\xa0 la carte, ' * 5", stretch = True))
+        c.body.add_child(cm(15,0), Text( (20,5), value = "'\xc2\xa9 %s'%row", alignment = Text.ALIGN_RIGHT))
+        c.body.add_child(cm(17,0), Text( (20,5), value = "'\xc3\x9cber'", alignment = Text.ALIGN_CENTER))
+        
+        # The stretched text takes 10 lines (42.33 mm) on each row: 7 rows per page
+        pages = PDFRenderer(c).paginate(datasources = [dataproviders.DataProvider(range(10))])
+        self.assertEqual(pages, [(1, 7), (8, 10)])
+        
+        for class_ in (PDFRenderer, DirectPDFRenderer):
+            data = class_(c).render(datasources = [dataproviders.DataProvider(range(10))], output = "bytes")
+            self.assertEqual(len(re.findall("/Type /Page\\b", data)), len(pages))
+        
+        # The standard fonts use WinAnsiEncoding
+        data = DirectPDFRenderer(c).render(datasources = [dataproviders.DataProvider(range(10))], output = "bytes", compress = False)
+        self.assert_("(caf\xe9 0) Tj" in data)
+        self.assert_("(\xa9 9) Tj" in data)
+        self.assertEqual(pdfwriter.escape_string(u"\u20ac \u0394"), "(\x80 ?)")
+        
+    def testResolveFont(self):
+        r = PDFRenderer(Report())
+        
+        font = Font(None, "Helvetica", 10, style = [Font.ITALIC])
+        resolved = r.resolve_font(font)
+        
+        self.assert_(resolved is r.resolve_font(font))
+        self.assertEqual(resolved.face, "Helvetica-Oblique")
+        self.assertEqual(resolved.size, 10)
+        self.assert_(0 < resolved.ascent < 10)
+        self.assert_(resolved.descent < 0)
+        
+        resolved = r.resolve_font(Font(None, "Helvetica", 10, style = [Font.ITALIC, Font.BOLD]))
+        self.assertEqual(resolved.face, "Helvetica-BoldOblique")
+        
+    def testGraphicsState(self):
+        class _Canvas(object):
+            def __init__(self):
+                self.calls = list()
+            def __getattr__(self, name):
+                return lambda *args: self.calls.append(name)
+        
+        c = _Canvas()
+        state = GraphicsState(c)
+        
+        for x in range(3):
+            state.set_font("Helvetica", 10)
+            state.set_fill_color(Color.RED)
+            state.set_stroke_color(Color(255, 0, 0))
+            state.set_line_width(0.5)
+        
+        self.assertEqual(c.calls, ["setFont", "setFillColorRGB", "setStrokeColorRGB", "setLineWidth"])
+        
+        state.set_font("Helvetica", 12)
+        state.set_fill_color(Color.BLACK)
+        self.assertEqual(c.calls[4:], ["setFont", "setFillColorRGB"])
+        
+        # A new page starts from the default state
+        state.reset()
+        state.set_line_width(0.5)
+        self.assertEqual(c.calls[6:], ["setLineWidth"])
+        
 suite = unittest.makeSuite(TestRenderers)
 
 __all__=["suite"]